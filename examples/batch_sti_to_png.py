@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+##############################################################################
+#
+# This file is part of JA2 Open Toolset
+#
+# JA2 Open Toolset is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JA2 Open Toolset is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from ja2py.export import convert_stis_to_png
+from sti_sources import add_source_arguments, read_source_arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Batch STI to PNG Converter')
+    add_source_arguments(parser, "paths to STI files", "folder for the converted PNG files")
+    parser.add_argument(
+        '-c',
+        '--compress-level',
+        type=int,
+        default=6,
+        choices=range(10),
+        help="zlib compression level of the PNG files, lower is faster, default: 6"
+    )
+    parser.add_argument('--chunk-size', type=int, default=32, help="number of sub images converted per job")
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help="be verbose, e.g. print the names of the written files"
+    )
+    args = parser.parse_args()
+
+    sources, output_folder = read_source_arguments(args)
+    if args.verbose:
+        print("Converting {} STI files into {}".format(len(sources), output_folder))
+
+    written = convert_stis_to_png(sources, output_folder, compress_level=args.compress_level,
+                                  chunk_size=args.chunk_size, max_workers=args.jobs)
+
+    if args.verbose:
+        for path in written:
+            print("Written:  {}".format(path))
+        print("PNG files: {}".format(len(written)))
+        print("Done")
+
+if __name__ == "__main__":
+    main()
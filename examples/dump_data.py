@@ -27,7 +27,7 @@ import json
 
 sys.path.append(os.getcwd())
 
-from ja2py.fileformats import SlfFS, Sti, is_8bit_sti, is_16bit_sti, load_8bit_sti, load_16bit_sti, load_gap
+from ja2py.fileformats import SlfFS, Sti, probe_sti, open_sti, load_gap
 from sti_to_png import write_8bit_png_from_sti, write_24bit_png_from_sti
 
 
@@ -53,12 +53,13 @@ def dump_sti(output_folder, file_path, slf_fs, args):
     with slf_fs.open(file_path, 'rb') as file:
         if not os.path.exists(to_dir):
             os.makedirs(to_dir)
-        if is_8bit_sti(file):
-            sti = load_8bit_sti(file)
+        if probe_sti(file).kind is None:
+            return
+        info, sti = open_sti(file)
+        if info.kind == '8bit':
             to_path = os.path.splitext(to_path)[0] + '.STI' if len(sti.images) > 1 else os.path.splitext(to_path)[0] + '.png'
             write_8bit_png_from_sti(to_path, sti, verbose=args.verbose)
-        elif is_16bit_sti(file):
-            sti = load_16bit_sti(file)
+        else:
             write_24bit_png_from_sti(to_path, sti, verbose=args.verbose)
 
 
@@ -0,0 +1,60 @@
+##############################################################################
+#
+# This file is part of JA2 Open Toolset
+#
+# JA2 Open Toolset is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JA2 Open Toolset is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+
+from ja2py.fileformats import SlfFS
+
+
+def add_source_arguments(parser, sti_files_help, output_folder_help):
+    """Adds the arguments for the STI files, the output folder and the number of processes of a batch converter."""
+    parser.add_argument('sti_files', nargs='*', help=sti_files_help)
+    parser.add_argument(
+        '-s',
+        '--slf-file',
+        default=None,
+        help="SLF file to read STI files from, in addition to the STI file paths"
+    )
+    parser.add_argument(
+        '-p',
+        '--pattern',
+        default='*.STI',
+        help="wildcard pattern for the STI files in the SLF file, default: *.STI"
+    )
+    parser.add_argument('-o', '--output-folder', default='.', help=output_folder_help)
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="number of processes, default: number of CPUs")
+
+
+def normalize_path(path):
+    return os.path.normpath(os.path.abspath(os.path.expanduser(os.path.expandvars(path))))
+
+
+def read_source_arguments(args):
+    """
+    Returns the sources for the functions of ja2py.export, i.e. STI file paths and (SlfFS, path) tuples, and the
+    output folder of the arguments of add_source_arguments. Exits if there are no STI files.
+    """
+    sources = [normalize_path(f) for f in args.sti_files]
+    if args.slf_file:
+        slf_fs = SlfFS(args.slf_file)
+        sources += [(slf_fs, path) for path in slf_fs.query(args.pattern)]
+    if not sources:
+        print("Error: no STI files given", file=sys.stderr)
+        exit(1)
+    return sources, normalize_path(args.output_folder)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+##############################################################################
+#
+# This file is part of JA2 Open Toolset
+#
+# JA2 Open Toolset is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JA2 Open Toolset is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import argparse
+import os
+import sys
+
+sys.path.append(os.getcwd())
+
+from ja2py.export import write_atlases
+from sti_sources import add_source_arguments, read_source_arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description='STI to Texture Atlas Converter')
+    add_source_arguments(parser, "paths to STI files", "folder for the atlas pages and the manifest")
+    parser.add_argument('-n', '--name', default='atlas', help="base name of the atlas pages and the manifest")
+    parser.add_argument('--max-size', type=int, default=2048, help="maximum width and height of an atlas page")
+    parser.add_argument('--padding', type=int, default=1, help="pixels between the images in an atlas page")
+    parser.add_argument(
+        '-v',
+        '--verbose',
+        action='store_true',
+        default=False,
+        help="be verbose, e.g. print information about the atlas pages"
+    )
+    args = parser.parse_args()
+
+    sources, output_folder = read_source_arguments(args)
+    if args.verbose:
+        print("Packing {} STI files into {}".format(len(sources), output_folder))
+
+    manifest = write_atlases(sources, output_folder, name=args.name, max_size=args.max_size, padding=args.padding,
+                             max_workers=args.jobs)
+
+    if args.verbose:
+        for page in manifest['pages']:
+            print("Page {}: {}x{}".format(page['file'], page['width'], page['height']))
+        print("Images: {}".format(len(manifest['sprites'])))
+        print("Done")
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,7 @@ import sys
 
 sys.path.append(os.getcwd())
 
-from ja2py.fileformats.Sti import load_8bit_sti, load_16bit_sti, is_8bit_sti, is_16bit_sti
+from ja2py.fileformats.Sti import open_sti
 
 def write_image(output_file, image, transparency=0, verbose=False):
     if verbose:
@@ -93,31 +93,29 @@ def main():
         print("Input file:  {}".format(sti_file))
         print("Output file: {}".format(output_file))
 
-    with open(sti_file, 'rb') as file:
-        if is_8bit_sti(file):
-            sti = load_8bit_sti(file)
-            if args.verbose:
-                print("File Details: ")
-                print("Data Type: indexed 8bit")
-                print("Number of single images: {}".format(len(sti)))
-                for i, sub_image in enumerate(sti.images):
-                    print("Subimage {}: Size {}x{}, Shift +{}+{}".format(
-                        i+1,
-                        sub_image.image.size[0],
-                        sub_image.image.size[1],
-                        sub_image.offsets[0],
-                        sub_image.offsets[1]
-                    ))
-            write_8bit_png_from_sti(output_file, sti, verbose=args.verbose)
-        elif is_16bit_sti(file):
-            sti = load_16bit_sti(file)
-            if args.verbose:
-                print("File Details: ")
-                print("Data Type: RGB 16bit")
-                write_24bit_png_from_sti(output_file, sti, verbose=args.verbose)
-
+    info, sti = open_sti(sti_file)
+    if info.kind == '8bit':
+        if args.verbose:
+            print("File Details: ")
+            print("Data Type: indexed 8bit")
+            print("Number of single images: {}".format(len(sti)))
+            for i, sub_image in enumerate(sti.images):
+                print("Subimage {}: Size {}x{}, Shift +{}+{}".format(
+                    i+1,
+                    sub_image.image.size[0],
+                    sub_image.image.size[1],
+                    sub_image.offsets[0],
+                    sub_image.offsets[1]
+                ))
+        write_8bit_png_from_sti(output_file, sti, verbose=args.verbose)
+    else:
         if args.verbose:
-            print("Done")
+            print("File Details: ")
+            print("Data Type: RGB 16bit")
+        write_24bit_png_from_sti(output_file, sti, verbose=args.verbose)
+
+    if args.verbose:
+        print("Done")
 
 if __name__ == "__main__":
     main()
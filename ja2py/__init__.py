@@ -16,5 +16,5 @@
 # along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
-from . import content, fileformats
-__all__ = ["content", "fileformats"]
\ No newline at end of file
+from . import content, export, fileformats
+__all__ = ["content", "export", "fileformats"]
\ No newline at end of file
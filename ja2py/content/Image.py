@@ -1,4 +1,3 @@
-from functools import reduce
 from PIL import Image, ImagePalette
 
 class Image16Bit(object):
@@ -42,53 +41,84 @@ class Images8Bit(object):
         self.width = width
         self.height = height
 
-        for sub_image in images:
-            self._validate_sub_image(sub_image)
-        self._images = tuple(images)
+        self._images = list(images)
+        palette_fingerprint = self._palette_fingerprint()
+        for sub_image in self._images:
+            self._validate_sub_image(sub_image, palette_fingerprint)
+        self._images_changed()
 
-    def _validate_sub_image(self, sub_image):
+    def _palette_fingerprint(self):
+        """The palette data, taken once per change of the images so that changes of the palette are seen."""
+        return self._palette.getdata()[1]
+
+    def _validate_sub_image(self, sub_image, palette_fingerprint):
         if not isinstance(sub_image, SubImage8Bit):
             raise ValueError('All images need be of SubImage8Bit class for Images8Bit')
-        if sub_image.image.palette.getdata()[1] != self._palette.getdata()[1]:
+        palette = sub_image.image.palette
+        if palette is not self._palette and palette.getdata()[1] != palette_fingerprint:
             raise ValueError('All images need to have the same palette for Images8Bit')
 
+    def _images_changed(self):
+        self._images_tuple = None
+        self._animation_table = None
+        self._animations = None
+
     @property
     def palette(self):
         return self._palette
 
     @property
     def images(self):
-        return self._images
+        if self._images_tuple is None:
+            self._images_tuple = tuple(self._images)
+        return self._images_tuple
+
+    @property
+    def animation_table(self):
+        """
+        Tuple of (start index, number of frames) for each animation. An animation starts at every sub image with
+        aux data that has a non zero number_of_frames. Empty if the images are not animated.
+        The table is rebuilt when sub images are added or removed.
+        """
+        if self._animation_table is None:
+            starts = list(i for i, sub_img in enumerate(self._images)
+                          if sub_img.aux_data is not None and sub_img.aux_data['number_of_frames'] != 0)
+            if starts and starts[0] != 0:
+                starts.insert(0, 0)
+            ends = starts[1:] + [len(self._images)]
+            self._animation_table = tuple((start, end - start) for start, end in zip(starts, ends))
+        return self._animation_table
 
     @property
     def animated(self):
-        return any(i.aux_data is not None and i.aux_data['number_of_frames'] != 0 for i in self._images)
+        return len(self.animation_table) != 0
 
     @property
     def animations(self):
-        def reducer(acc, sub_img):
-            if sub_img.aux_data['number_of_frames'] != 0:
-                acc.append([])
-            acc[-1].append(sub_img)
-            return acc
         if not self.animated:
             return None
-        return tuple(tuple(i) for i in reduce(reducer, self._images, []))
+        if self._animations is None:
+            images = self.images
+            self._animations = tuple(images[start:start + count] for start, count in self.animation_table)
+        return self._animations
 
     def append(self, sub_img):
-        self._validate_sub_image(sub_img)
-        self._images = self._images + (sub_img,)
+        self._validate_sub_image(sub_img, self._palette_fingerprint())
+        self._images.append(sub_img)
+        self._images_changed()
 
     def insert(self, i, sub_img):
         if i < 0 or i > len(self._images):
             raise ValueError('Index {{0}} out of bounds'.format(i))
-        self._validate_sub_image(sub_img)
-        self._images = self._images[:i] + (sub_img,) + self._images[i:]
+        self._validate_sub_image(sub_img, self._palette_fingerprint())
+        self._images.insert(i, sub_img)
+        self._images_changed()
 
     def remove(self, sub_img):
         if sub_img not in self._images:
             raise ValueError('SubImage is not in images')
-        self._images = tuple(i for i in self._images if i is not sub_img)
+        self._images = list(i for i in self._images if i is not sub_img)
+        self._images_changed()
 
     def __len__(self):
         return len(self._images)
@@ -0,0 +1,209 @@
+##############################################################################
+#
+# This file is part of JA2 Open Toolset
+#
+# JA2 Open Toolset is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JA2 Open Toolset is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from PIL import Image, ImageFile
+
+from ..fileformats.Sti import probe_sti, load_8bit_sti, load_8bit_sti_sub_images
+from ..fileformats.common import signed_offset
+from .common import source_file, read_source
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+APNG_DISPOSE_OP_BACKGROUND = 1
+APNG_BLEND_OP_SOURCE = 0
+GIF_DISPOSE_BACKGROUND = 2
+FORMAT_EXTENSIONS = {'APNG': '.png', 'GIF': '.gif'}
+
+
+def _frames(animation):
+    """
+    Returns the canvas size of an animation and the (x, y, image) of each frame on the canvas.
+    The canvas covers the sub images of all frames placed by their offsets, empty sub images become a single
+    transparent pixel.
+    """
+    boxes = []
+    for sub_image in animation:
+        x, y = signed_offset(sub_image.offsets[0]), signed_offset(sub_image.offsets[1])
+        width, height = sub_image.image.size
+        boxes.append((x, y, x + width, y + height) if width and height else None)
+    used = list(box for box in boxes if box is not None)
+    left = min((box[0] for box in used), default=0)
+    top = min((box[1] for box in used), default=0)
+    right = max((box[2] for box in used), default=1)
+    bottom = max((box[3] for box in used), default=1)
+
+    frames = []
+    for sub_image, box in zip(animation, boxes):
+        if box is None:
+            frames.append((0, 0, Image.new('P', (1, 1))))
+        else:
+            frames.append((box[0] - left, box[1] - top, sub_image.image))
+    return (right - left, bottom - top), frames
+
+
+def _palette_bytes(animation):
+    # empty images lose their palette in Pillow, a fully transparent animation does not need one
+    images = list(sub_image.image for sub_image in animation if sub_image.image.size[0] and sub_image.image.size[1])
+    if not images:
+        return 768 * b'\x00'
+    return bytes(images[0].getpalette()[:768]).ljust(768, b'\x00')
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _png_image_data(image, compress_level):
+    width = image.size[0]
+    data = image.tobytes()
+    rows = (data[i:i + width] for i in range(0, len(data), width))
+    return zlib.compress(b''.join(b'\x00' + row for row in rows), compress_level)
+
+
+def _save_apng(animation, file, duration, loop, compress_level):
+    size, frames = _frames(animation)
+    # the first frame needs to cover the whole canvas
+    x, y, image = frames[0]
+    first = Image.new('P', size)
+    first.paste(image, (x, y))
+    frames[0] = (0, 0, first)
+
+    file.write(PNG_SIGNATURE)
+    file.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, 3, 0, 0, 0)))
+    file.write(_png_chunk(b'PLTE', _palette_bytes(animation)))
+    file.write(_png_chunk(b'tRNS', b'\x00'))  # palette index 0 is transparent
+    file.write(_png_chunk(b'acTL', struct.pack('>II', len(frames), loop)))
+    sequence_number = 0
+    for i, (x, y, image) in enumerate(frames):
+        file.write(_png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', sequence_number, image.size[0], image.size[1], x, y,
+                                                   duration, 1000, APNG_DISPOSE_OP_BACKGROUND, APNG_BLEND_OP_SOURCE)))
+        sequence_number += 1
+        data = _png_image_data(image, compress_level)
+        if i == 0:
+            file.write(_png_chunk(b'IDAT', data))
+        else:
+            file.write(_png_chunk(b'fdAT', struct.pack('>I', sequence_number) + data))
+            sequence_number += 1
+    file.write(_png_chunk(b'IEND', b''))
+
+
+def _encode_gif_frame(x, y, image, canvas_width):
+    """
+    Encodes the indexes of a frame at (x, y) as GIF image data, returns the x, y, width and height of the encoded frame
+    and the data.
+
+    The data is the lzw minimum code size 8, the lzw sub blocks and the block terminator. The sub blocks come from the
+    private 'gif' encoder of Pillow, which ImageFile._save runs like GifImagePlugin does. This relies on Pillow 4
+    (setup.py requires Pillow < 5 and this is checked with Pillow 4.3), the tests decode every pixel to catch changes.
+    The encoder writes broken data for images that are one pixel wide, so such frames are padded with a transparent
+    column, on the left if the frame is at the right border of the canvas.
+    """
+    if image.size[0] == 1:
+        padded = Image.new('P', (2, image.size[1]))
+        if x + 2 <= canvas_width:
+            padded.paste(image, (0, 0))
+        else:
+            padded.paste(image, (1, 0))
+            x -= 1
+        image = padded
+    output = BytesIO()
+    output.write(b'\x08')
+    ImageFile._save(image, output, [('gif', (0, 0) + image.size, 0, 'P')])
+    output.write(b'\x00')
+    return x, y, image.size[0], image.size[1], output.getvalue()
+
+
+def _save_gif(animation, file, duration, loop):
+    size, frames = _frames(animation)
+    size = (max(size[0], 2), size[1])  # room to pad frames that are one pixel wide
+
+    file.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0xf7, 0, 0))  # global color table of 256 colors
+    file.write(_palette_bytes(animation))
+    file.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+    for frame in frames:
+        x, y, width, height, data = _encode_gif_frame(frame[0], frame[1], frame[2], size[0])
+        # restore to the transparent background after each frame, palette index 0 is transparent
+        file.write(b'!\xf9\x04' + struct.pack('<BHBB', GIF_DISPOSE_BACKGROUND << 2 | 1, duration // 10, 0, 0))
+        file.write(b',' + struct.pack('<HHHHB', x, y, width, height, 0))
+        file.write(data)
+    file.write(b';')
+
+
+def save_8bit_animation(animation, file, format='APNG', duration=100, loop=0, compress_level=6):
+    """
+    Saves an animation, a sequence of SubImage8Bit like the items of Images8Bit.animations, as an APNG or GIF file.
+
+    The frames are written from the palette and the indexes of the sub images, positioned by their offsets on a canvas
+    that covers all frames. Palette index 0 is transparent. duration is the time each frame is shown in milliseconds,
+    GIF files round it down to hundredths of a second. loop is the number of repetitions, 0 repeats forever.
+    compress_level is the zlib level of APNG files.
+    """
+    if format not in FORMAT_EXTENSIONS:
+        raise ValueError('Unknown animation format {0}'.format(format))
+    if len(animation) == 0:
+        raise ValueError('An animation needs at least one frame')
+    if format == 'APNG':
+        _save_apng(animation, file, duration, loop, compress_level)
+    else:
+        _save_gif(animation, file, duration, loop)
+
+
+def _plan_jobs(name, file):
+    info = probe_sti(source_file(file))
+    if info.kind != '8bit':
+        return []
+    sti = load_8bit_sti(source_file(file), lazy=True)
+    return list((file, start, count, os.path.join(name, 'ANI{0}'.format(i)))
+                for i, (start, count) in enumerate(sti.animation_table))
+
+
+def _write_job(job):
+    file, start, count, path, output_directory, options = job
+    path = os.path.join(output_directory, path + FORMAT_EXTENSIONS[options['format']])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    animation = load_8bit_sti_sub_images(source_file(file), range(start, start + count))
+    with open(path, 'wb') as output_file:
+        save_8bit_animation(animation, output_file, **options)
+    return path
+
+
+def write_8bit_animations(sources, output_directory, format='APNG', max_workers=None, **kwargs):
+    """
+    Writes each animation of many animated 8bit sti files to a `<name>/ANI<animation>.png` or `.gif` file in
+    output_directory with save_8bit_animation, which also takes the keyword arguments.
+
+    Sources are paths of sti files or (SlfFS, path) tuples, files that are not animated 8bit sti files are skipped.
+    Name is the file name of a path or the path inside the SLF file without extension. The animations are encoded in
+    parallel by up to max_workers processes, max_workers=1 encodes them in this process.
+    Returns the list of the written paths.
+    """
+    if format not in FORMAT_EXTENSIONS:
+        raise ValueError('Unknown animation format {0}'.format(format))
+    options = dict(kwargs, format=format)
+    jobs = list(job + (output_directory, options)
+                for name, file in map(read_source, sources)
+                for job in _plan_jobs(name, file))
+    if max_workers == 1:
+        return list(map(_write_job, jobs))
+    with ProcessPoolExecutor(max_workers) as executor:
+        return list(executor.map(_write_job, jobs))
@@ -0,0 +1,209 @@
+##############################################################################
+#
+# This file is part of JA2 Open Toolset
+#
+# JA2 Open Toolset is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JA2 Open Toolset is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+
+from ..fileformats.Sti import open_sti
+from ..fileformats.common import signed_offset
+from .common import source_file, read_source
+
+TRANSPARENT_ALPHA = b'\x00' + 255 * b'\xff'  # palette index 0 is transparent
+
+
+class MaxRectsPacker(object):
+    """
+    Packs rectangles into an area of a fixed size with the MaxRects algorithm.
+    Each rectangle is placed into the free rectangle where it leaves the shortest side over (best short side fit).
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free_rectangles = [(0, 0, width, height)]
+
+    def insert(self, width, height):
+        """Returns the (x, y) position of the rectangle or None if it does not fit."""
+        best = None
+        best_fit = None
+        for free_x, free_y, free_width, free_height in self.free_rectangles:
+            if width > free_width or height > free_height:
+                continue
+            leftover_x = free_width - width
+            leftover_y = free_height - height
+            fit = (min(leftover_x, leftover_y), max(leftover_x, leftover_y))
+            if best_fit is None or fit < best_fit:
+                best = (free_x, free_y)
+                best_fit = fit
+        if best is not None:
+            self._place(best[0], best[1], width, height)
+        return best
+
+    def _place(self, x, y, width, height):
+        free_rectangles = []
+        for free in self.free_rectangles:
+            free_x, free_y, free_width, free_height = free
+            if (x >= free_x + free_width or x + width <= free_x or
+                    y >= free_y + free_height or y + height <= free_y):
+                free_rectangles.append(free)
+                continue
+            # split the free rectangle into the maximal rectangles around the placed one
+            if x > free_x:
+                free_rectangles.append((free_x, free_y, x - free_x, free_height))
+            if x + width < free_x + free_width:
+                free_rectangles.append((x + width, free_y, free_x + free_width - x - width, free_height))
+            if y > free_y:
+                free_rectangles.append((free_x, free_y, free_width, y - free_y))
+            if y + height < free_y + free_height:
+                free_rectangles.append((free_x, y + height, free_width, free_y + free_height - y - height))
+        self.free_rectangles = _remove_contained(free_rectangles)
+
+
+def _remove_contained(rectangles):
+    rectangles = sorted(set(rectangles), key=lambda r: r[2] * r[3], reverse=True)
+    result = []
+    for x, y, width, height in rectangles:
+        if not any(x >= other_x and y >= other_y and x + width <= other_x + other_width and
+                   y + height <= other_y + other_height for other_x, other_y, other_width, other_height in result):
+            result.append((x, y, width, height))
+    return result
+
+
+def _next_power_of_two(value):
+    return 1 << max(0, (value - 1).bit_length())
+
+
+def pack_rectangles(sizes, max_size=2048, padding=1):
+    """
+    Packs rectangles of the given (width, height) sizes into pages of at most max_size x max_size pixels.
+    Returns the (page, x, y) position of each rectangle and the (width, height) of each page.
+    The pages are shrunk to the smallest power of two sizes that fit their rectangles.
+    """
+    positions = [None] * len(sizes)
+    packers = []
+    order = sorted(range(len(sizes)), key=lambda i: (max(sizes[i]), sizes[i][0] * sizes[i][1]), reverse=True)
+    for i in order:
+        width, height = sizes[i]
+        if width == 0 or height == 0:
+            positions[i] = (0, 0, 0)
+            continue
+        if width > max_size or height > max_size:
+            raise ValueError('Rectangle of size {0}x{1} does not fit into {2}x{2} pages'.format(width, height, max_size))
+        # the padding of the last row and column may be outside of the page
+        for page, packer in enumerate(packers):
+            position = packer.insert(width + padding, height + padding)
+            if position is not None:
+                break
+        else:
+            page = len(packers)
+            packers.append(MaxRectsPacker(max_size + padding, max_size + padding))
+            position = packers[page].insert(width + padding, height + padding)
+        positions[i] = (page,) + position
+
+    if not packers and sizes:
+        packers.append(None)
+    page_extents = [[1, 1] for _ in packers]
+    for (page, x, y), (width, height) in zip(positions, sizes):
+        page_extents[page][0] = max(page_extents[page][0], x + width)
+        page_extents[page][1] = max(page_extents[page][1], y + height)
+    page_sizes = list((_next_power_of_two(width), _next_power_of_two(height)) for width, height in page_extents)
+    return positions, page_sizes
+
+
+def _to_rgba(image):
+    rgba = image.convert('RGBA')
+    if image.mode == 'P':
+        rgba.putalpha(Image.frombytes('L', image.size, image.tobytes().translate(TRANSPARENT_ALPHA)))
+    return rgba
+
+
+def _load_sprites(job):
+    """Loads the sub images of a sti file as (index, size, rgba data, offsets, aux_data) tuples."""
+    name, file = job
+    info, sti = open_sti(source_file(file))
+    if info.kind == '16bit':
+        images = [(sti.image, (0, 0), None)]
+    else:
+        images = [(sub_image.image, sub_image.offsets, sub_image.aux_data) for sub_image in sti.images]
+    return list((index, image.size, _to_rgba(image).tobytes(), offsets, aux_data)
+                for index, (image, offsets, aux_data) in enumerate(images))
+
+
+def build_atlases(sources, max_size=2048, padding=1, max_workers=None):
+    """
+    Packs the sub images of many sti files into RGBA texture atlas pages with power of two sizes.
+
+    Sources are paths of sti files or (SlfFS, path) tuples. The sti files are loaded in parallel by up to max_workers
+    processes, max_workers=1 loads them in this process.
+    Returns a list of the page images and a manifest dict that describes the source, position, offsets and aux data of
+    each sub image. The source is the file name of a path or the path inside the SLF file without extension.
+    """
+    jobs = list(map(read_source, sources))
+    if max_workers == 1:
+        loaded = list(map(_load_sprites, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers) as executor:
+            loaded = list(executor.map(_load_sprites, jobs))
+    sprites = list((name,) + sprite for (name, _), sprites in zip(jobs, loaded) for sprite in sprites)
+
+    positions, page_sizes = pack_rectangles(list(sprite[2] for sprite in sprites), max_size, padding)
+
+    pages = list(Image.new('RGBA', size, (0, 0, 0, 0)) for size in page_sizes)
+    manifest_sprites = []
+    for (name, index, size, data, offsets, aux_data), (page, x, y) in zip(sprites, positions):
+        width, height = size
+        if width > 0 and height > 0:
+            pages[page].paste(Image.frombytes('RGBA', size, data), (x, y))
+        page_width, page_height = page_sizes[page]
+        manifest_sprites.append({
+            'source': name,
+            'index': index,
+            'page': page,
+            'x': x,
+            'y': y,
+            'width': width,
+            'height': height,
+            'uv': [x / page_width, y / page_height, (x + width) / page_width, (y + height) / page_height],
+            'offset_x': signed_offset(offsets[0]),
+            'offset_y': signed_offset(offsets[1]),
+            'aux_data': aux_data,
+        })
+    manifest = {
+        'pages': list({'width': width, 'height': height} for width, height in page_sizes),
+        'sprites': manifest_sprites,
+    }
+    return pages, manifest
+
+
+def write_atlases(sources, output_directory, name='atlas', **kwargs):
+    """
+    Builds the atlases of build_atlases and writes them as `<name>_<page>.png` files and a `<name>.json` manifest
+    into output_directory. Returns the manifest.
+    """
+    pages, manifest = build_atlases(sources, **kwargs)
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+    for i, (page, page_info) in enumerate(zip(pages, manifest['pages'])):
+        page_info['file'] = '{0}_{1}.png'.format(name, i)
+        page.save(os.path.join(output_directory, page_info['file']))
+    with open(os.path.join(output_directory, name + '.json'), 'w', encoding='utf8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    return manifest
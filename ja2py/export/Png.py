@@ -0,0 +1,96 @@
+##############################################################################
+#
+# This file is part of JA2 Open Toolset
+#
+# JA2 Open Toolset is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JA2 Open Toolset is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from ..fileformats.Sti import probe_sti, load_8bit_sti, load_8bit_sti_sub_images, load_16bit_sti
+from .common import source_file, read_source
+
+
+def _frame_names(name, sti):
+    """
+    Returns the relative png path of each sub image.
+    Unlike examples/sti_to_png.py and examples/dump_data.py the directory of the sub images has no extension.
+    """
+    if len(sti.images) == 1:
+        return [name + '.png']
+    if not sti.animated:
+        return list(os.path.join(name, '{0}.png'.format(i)) for i in range(len(sti.images)))
+    return list(os.path.join(name, 'ANI{0}'.format(a), '{0}.png'.format(i))
+                for a, (_, count) in enumerate(sti.animation_table) for i in range(count))
+
+
+def _plan_jobs(name, file, chunk_size):
+    """Splits the conversion of a sti file into jobs of at most chunk_size sub images."""
+    info = probe_sti(source_file(file))
+    if info.kind == '16bit':
+        return [(file, None, [name + '.png'])]
+    if info.kind != '8bit':
+        return []
+    names = _frame_names(name, load_8bit_sti(source_file(file), lazy=True))
+    return list((file, list(range(start, min(start + chunk_size, len(names)))), names[start:start + chunk_size])
+                for start in range(0, len(names), chunk_size))
+
+
+def _convert_job(job):
+    """Decodes the sub images of a job and writes them as png files."""
+    file, indexes, paths, output_directory, compress_level = job
+    if indexes is None:
+        images = [(load_16bit_sti(source_file(file)).image, None)]
+    else:
+        images = list((sub_image.image, 0) for sub_image in load_8bit_sti_sub_images(source_file(file), indexes))
+
+    written = []
+    for (image, transparency), path in zip(images, paths):
+        path = os.path.join(output_directory, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image.save(path, format='PNG', transparency=transparency, compress_level=compress_level)
+        written.append(path)
+    return written
+
+
+def convert_stis_to_png(sources, output_directory, compress_level=6, chunk_size=32, max_workers=None):
+    """
+    Converts many sti files to png files in output_directory.
+
+    Sources are paths of sti files or (SlfFS, path) tuples, files that are not sti files are skipped. A sti file with
+    a single image is written to `<name>.png`, the sub images of other 8bit sti files to `<name>/<index>.png` or
+    `<name>/ANI<animation>/<index>.png` for animated ones. Name is the file name of a path or the path inside the SLF
+    file without extension. The directory has no extension, unlike the `<name>.png` directory of
+    examples/sti_to_png.py and the `<name>.STI` directory of examples/dump_data.py.
+
+    The sub images of each file are split into jobs of at most chunk_size images that are decoded and written in
+    parallel by up to max_workers processes, max_workers=1 converts them in this process. compress_level is the zlib
+    level of the png files from 0 to 9, lower levels are faster.
+    Returns the list of the written png paths.
+    """
+    if not 0 <= compress_level <= 9:
+        raise ValueError('compress_level needs to be from 0 to 9')
+    if chunk_size <= 0:
+        raise ValueError('chunk_size needs to be positive')
+    jobs = list(job + (output_directory, compress_level)
+                for name, file in map(read_source, sources)
+                for job in _plan_jobs(name, file, chunk_size))
+    if max_workers == 1:
+        written = list(map(_convert_job, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers) as executor:
+            written = list(executor.map(_convert_job, jobs))
+    return list(path for paths in written for path in paths)
@@ -0,0 +1,38 @@
+##############################################################################
+#
+# This file is part of JA2 Open Toolset
+#
+# JA2 Open Toolset is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# JA2 Open Toolset is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with JA2 Open Toolset.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+import os
+from io import BytesIO
+
+
+def source_file(file):
+    """Returns a file object for the contents of a sti file and a path as is."""
+    return BytesIO(file) if isinstance(file, bytes) else file
+
+
+def read_source(source):
+    """
+    Returns the relative output path without extension and the path or the contents of a source.
+    Sources are paths of sti files or (SlfFS, path) tuples, the files in a SLF file are read in this process.
+    """
+    if isinstance(source, str):
+        return os.path.splitext(os.path.basename(source))[0], source
+    slf_fs, path = source
+    with slf_fs.open(path, 'rb') as file:
+        return os.path.splitext(path.lstrip('/'))[0], file.read()
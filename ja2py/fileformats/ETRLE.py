@@ -17,68 +17,341 @@
 #
 ##############################################################################
 
-import io
-import struct
+import re
 
 ALPHA_VALUE = 0
 IS_COMPRESSED_BYTE_MASK = 0x80
 NUMBER_OF_BYTES_MASK = 0x7F
 
+# runs of zeros (group 1) and runs of other bytes
+_RUNS = re.compile(b'(\x00+)|[^\x00]+')
+# same as above, but single zeros are part of the runs of other bytes unless they are at the end
+_LITERAL_LONE_ZERO_RUNS = re.compile(b'(\x00\x00+|\x00\\Z)|(?:[^\x00]|\x00(?=[^\x00]))+')
+
 
 class EtrleException(Exception):
     """Raised when an error in compression or decompression occurs"""
     pass
 
 
+class EtrleDecompressor(object):
+    """
+    Incremental ETRLE decompression, similar to zlib.decompressobj.
+    The compressed data can be passed to `decompress` in chunks of any size.
+    """
+
+    def __init__(self):
+        self.literal_bytes = 0  # bytes of the current uncompressed run that did not arrive yet
+
+    def decompress(self, data):
+        """Returns the bytes that can be decompressed with this chunk of data."""
+        data = _as_buffer(data)
+        end = len(data)
+        position = min(self.literal_bytes, end)
+        extracted_buffer = bytearray(data[:position])
+        self.literal_bytes -= position
+        while position < end:
+            control_byte = data[position]
+            length_of_subsequence = control_byte & NUMBER_OF_BYTES_MASK
+            position += 1
+            if control_byte & IS_COMPRESSED_BYTE_MASK:
+                extracted_buffer.extend(bytes([ALPHA_VALUE]) * length_of_subsequence)
+            else:
+                extracted_buffer.extend(data[position:position + length_of_subsequence])
+                self.literal_bytes = max(position + length_of_subsequence - end, 0)
+                position += length_of_subsequence
+        return bytes(extracted_buffer)
+
+    def flush(self):
+        """Checks that all the data was decompressed."""
+        if self.literal_bytes != 0:
+            raise EtrleException('Not enough data to decompress')
+        return b''
+
+
 def etrle_decompress(data):
-    number_of_compressed_bytes = len(data)
-    compressed_bytes = struct.unpack('<{}B'.format(number_of_compressed_bytes), data)
-    extracted_buffer = io.BytesIO()
-    bytes_til_next_control_byte = 0
-
-    for current_byte in compressed_bytes:
-        if bytes_til_next_control_byte == 0:
-            is_compressed_alpha_byte = ((current_byte & IS_COMPRESSED_BYTE_MASK) >> 7) == 1
-            length_of_subsequence = current_byte & NUMBER_OF_BYTES_MASK
-            if is_compressed_alpha_byte:
-                for s in range(length_of_subsequence):
-                    extracted_buffer.write(struct.pack('<B', ALPHA_VALUE))
+    decompressor = EtrleDecompressor()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def etrle_remap(data, table):
+    """
+    Maps the palette indexes of ETRLE compressed data through a table of 256 indexes without decompressing it.
+    Only the uncompressed runs contain indexes, so the table has to map index 0 to 0 like the compressed runs.
+    The result has the same control bytes and length as data.
+    """
+    table = _as_buffer(table)
+    if len(table) != 256:
+        raise EtrleException('Remap table needs 256 indexes')
+    if table[0] != ALPHA_VALUE:
+        raise EtrleException('Remap table needs to map index 0 to 0')
+    data = _as_buffer(data)
+    remapped = bytearray(bytes(data).translate(table))
+    position = 0
+    end = len(data)
+    while position < end:
+        control_byte = data[position]
+        remapped[position] = control_byte
+        position += 1
+        if not control_byte & IS_COMPRESSED_BYTE_MASK:
+            position += control_byte
+    if position != end:
+        raise EtrleException('Not enough data to remap')
+    return bytes(remapped)
+
+
+def _etrle_rows(data, width, height):
+    """
+    Returns the runs of each row of ETRLE compressed data as lists of (start, count) tuples.
+    `start` is the position of the indexes in data, or None for runs of transparent indexes.
+    Runs that continue on the next row are split, the control bytes with length 0 that end the rows are skipped.
+    """
+    if width < 0 or height < 0:
+        raise EtrleException('Invalid image size {0}x{1}'.format(width, height))
+    rows = []
+    row = []
+    x = 0
+    y = 0
+    position = 0
+    end = len(data)
+    while height > 0:
+        if x == width:
+            rows.append(row)
+            y += 1
+            if y == height:
+                break
+            row = []
+            x = 0
+            continue
+        if position >= end:
+            raise EtrleException('Not enough data for {0} rows'.format(height))
+        control_byte = data[position]
+        position += 1
+        if control_byte == 0:
+            continue # end of row
+        length_of_subsequence = control_byte & NUMBER_OF_BYTES_MASK
+        start = None
+        if not control_byte & IS_COMPRESSED_BYTE_MASK:
+            start = position
+            position += length_of_subsequence
+            if position > end:
+                raise EtrleException('Not enough data for {0} rows'.format(height))
+        if x + length_of_subsequence <= width:
+            row.append((start, length_of_subsequence))
+            x += length_of_subsequence
+            continue
+        while length_of_subsequence > 0: # continues on the next rows
+            if x == width:
+                rows.append(row)
+                row = []
+                x = 0
+                y += 1
+                if y == height:
+                    raise EtrleException('Too much data for {0} rows'.format(height))
+            count = min(length_of_subsequence, width - x)
+            row.append((start, count))
+            x += count
+            length_of_subsequence -= count
+            if start is not None:
+                start += count
+    return rows
+
+
+def _etrle_compress_segments(segments, compressed_buffer):
+    """
+    Appends a row of (indexes, count) segments as ETRLE runs followed by the row end.
+    `indexes` is a bytes-like object with count indexes, or None for transparent indexes.
+    Consecutive segments of the same kind are joined into the same runs.
+    """
+    zeros = 0
+    literal = []
+    for indexes, count in segments:
+        if indexes is None:
+            if literal:
+                _etrle_append_literal(literal, compressed_buffer)
+                literal = []
+            zeros += count
+        elif count > 0:
+            if zeros:
+                _etrle_append_zeros(zeros, compressed_buffer)
+                zeros = 0
+            literal.append(indexes)
+    if literal:
+        _etrle_append_literal(literal, compressed_buffer)
+    elif zeros:
+        _etrle_append_zeros(zeros, compressed_buffer)
+    compressed_buffer.append(0)
+
+
+def _etrle_append_zeros(count, compressed_buffer):
+    if count > NUMBER_OF_BYTES_MASK:
+        compressed_buffer.extend(b'\xff' * (count // NUMBER_OF_BYTES_MASK))
+        count %= NUMBER_OF_BYTES_MASK
+    if count:
+        compressed_buffer.append(count | IS_COMPRESSED_BYTE_MASK)
+
+
+def _etrle_append_literal(chunks, compressed_buffer):
+    indexes = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+    count = len(indexes)
+    if count <= NUMBER_OF_BYTES_MASK:
+        compressed_buffer.append(count)
+        compressed_buffer.extend(indexes)
+        return
+    for i in range(0, count, NUMBER_OF_BYTES_MASK):
+        runtime_length = min(count - i, NUMBER_OF_BYTES_MASK)
+        compressed_buffer.append(runtime_length)
+        compressed_buffer.extend(indexes[i:i + runtime_length])
+
+
+def _etrle_rows_bbox(data, rows):
+    x0 = None
+    x1 = 0
+    y0 = None
+    y1 = None
+    for y, row in enumerate(rows):
+        x = 0
+        for start, count in row:
+            if start is not None:
+                indexes = bytes(data[start:start + count])
+                leading_zeros = count - len(indexes.lstrip(b'\x00'))
+                if leading_zeros < count:
+                    trailing_zeros = count - len(indexes.rstrip(b'\x00'))
+                    if x0 is None or x + leading_zeros < x0:
+                        x0 = x + leading_zeros
+                    if x + count - trailing_zeros > x1:
+                        x1 = x + count - trailing_zeros
+                    if y0 is None:
+                        y0 = y
+                    y1 = y + 1
+            x += count
+    if y0 is None:
+        return None
+    return x0, y0, x1, y1
+
+
+def _etrle_crop_rows(data, rows, box):
+    x0, y0, x1, y1 = box
+    compressed_buffer = bytearray()
+    for row in rows[y0:y1]:
+        segments = []
+        x = 0
+        for start, count in row:
+            if x >= x0 and x + count <= x1: # whole run
+                segments.append((None if start is None else data[start:start + count], count))
             else:
-                bytes_til_next_control_byte = length_of_subsequence
-        else:
-            extracted_buffer.write(struct.pack('<B', current_byte))
-            bytes_til_next_control_byte -= 1
+                left = max(x, x0)
+                right = min(x + count, x1)
+                if left < right:
+                    segments.append((None if start is None else data[start + left - x:start + right - x], right - left))
+            x += count
+        _etrle_compress_segments(segments, compressed_buffer)
+    return bytes(compressed_buffer)
 
-    if bytes_til_next_control_byte != 0:
-        raise EtrleException('Not enough data to decompress')
 
-    return extracted_buffer.getvalue()
+def etrle_bbox(data, width, height):
+    """
+    Returns the bounding box (x0, y0, x1, y1) of the indexes that are not transparent (0) in ETRLE compressed data,
+    or None if all indexes are transparent. Only the uncompressed runs are looked at.
+    """
+    data = _as_buffer(data)
+    return _etrle_rows_bbox(data, _etrle_rows(data, width, height))
 
-def etrle_compress(data):
-    current = 0
-    source_length = len(data)
-    compressed_buffer = io.BytesIO()
 
-    while current < source_length:
-        runtime_length = 0
+def etrle_crop(data, width, height, box):
+    """
+    Returns the ETRLE compressed data of the rectangle box (x0, y0, x1, y1) of ETRLE compressed data.
+    The runs are cut at the box edges without decompressing the rows.
+    """
+    x0, y0, x1, y1 = box
+    if not (0 <= x0 <= x1 <= width and 0 <= y0 <= y1 <= height):
+        raise EtrleException('Invalid crop box {0} for image size {1}x{2}'.format(box, width, height))
+    data = _as_buffer(data)
+    return _etrle_crop_rows(data, _etrle_rows(data, width, height), box)
+
 
-        if data[current] == 0:
-            while current + runtime_length < source_length and data[current + runtime_length] == 0 and runtime_length < NUMBER_OF_BYTES_MASK:
-                runtime_length += 1
-            compressed_buffer.write(struct.pack('<B', runtime_length | IS_COMPRESSED_BYTE_MASK))
-        else:
-            while current + runtime_length < source_length and data[current + runtime_length] != 0 and runtime_length < NUMBER_OF_BYTES_MASK:
-                runtime_length += 1
-            compressed_buffer.write(struct.pack('<B', runtime_length))
-            compressed_buffer.write(struct.pack('<{}B'.format(runtime_length), * data[current:current+runtime_length]))
+def etrle_trim(data, width, height):
+    """
+    Crops ETRLE compressed data to the bounding box of the indexes that are not transparent, see etrle_bbox.
+    Returns a tuple of the bounding box and the cropped data, or None and the data if all indexes are transparent.
+    """
+    data = _as_buffer(data)
+    rows = _etrle_rows(data, width, height)
+    bbox = _etrle_rows_bbox(data, rows)
+    if bbox is None:
+        return None, bytes(data)
+    return bbox, _etrle_crop_rows(data, rows, bbox)
 
-        current += runtime_length
 
-    return compressed_buffer.getvalue()
+def etrle_hflip(data, width, height):
+    """
+    Returns ETRLE compressed data with mirrored rows, i.e. flipped horizontally.
+    The runs of each row are reversed without decompressing the rows.
+    """
+    data = _as_buffer(data)
+    compressed_buffer = bytearray()
+    for row in _etrle_rows(data, width, height):
+        segments = [(None if start is None else bytes(data[start:start + count])[::-1], count)
+                    for start, count in reversed(row)]
+        _etrle_compress_segments(segments, compressed_buffer)
+    return bytes(compressed_buffer)
 
 
+def _etrle_compress_runs(runs, data, start, end, compressed_buffer):
+    lone_zero = 0
+    for match in runs.finditer(data, start, end):
+        run_start, run_end = match.span()
+        if match.lastindex == 1:
+            number_of_zeros = run_end - run_start
+            if number_of_zeros > NUMBER_OF_BYTES_MASK:
+                compressed_buffer.extend(b'\xff' * (number_of_zeros // NUMBER_OF_BYTES_MASK))
+                number_of_zeros %= NUMBER_OF_BYTES_MASK
+            if number_of_zeros == 1 and run_end != end and runs is _LITERAL_LONE_ZERO_RUNS:
+                lone_zero = 1  # leading zero of the next uncompressed run
+            elif number_of_zeros != 0:
+                compressed_buffer.append(number_of_zeros | IS_COMPRESSED_BYTE_MASK)
+            continue
 
+        run_start -= lone_zero
+        lone_zero = 0
+        if run_end - run_start <= NUMBER_OF_BYTES_MASK:
+            compressed_buffer.append(run_end - run_start)
+            compressed_buffer.extend(data[run_start:run_end])
+            continue
+        for i in range(run_start, run_end, NUMBER_OF_BYTES_MASK):
+            runtime_length = min(run_end - i, NUMBER_OF_BYTES_MASK)
+            compressed_buffer.append(runtime_length)
+            compressed_buffer.extend(data[i:i + runtime_length])
 
 
+def _as_buffer(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return data
+    return bytes(data)
+
+
+def etrle_compress(data):
+    compressed_buffer = bytearray()
+    data = _as_buffer(data)
+    _etrle_compress_runs(_RUNS, data, 0, len(data), compressed_buffer)
+    return bytes(compressed_buffer)
 
 
+def etrle_compress_image(data, width, literal_lone_zeros=False):
+    """
+    Compresses the palette indexes of a whole image with rows of `width` pixels.
+    Each row is compressed like etrle_compress and terminated with a 0 byte.
+    With literal_lone_zeros=True zeros that are not part of a run of several zeros are kept in the uncompressed runs,
+    like StiImageEncoder does.
+    """
+    data = _as_buffer(data)
+    if width <= 0:
+        raise EtrleException('Invalid image width {0}'.format(width))
+    if len(data) % width != 0:
+        raise EtrleException('Image data is not a multiple of the width')
+    runs = _LITERAL_LONE_ZERO_RUNS if literal_lone_zeros else _RUNS
+    compressed_buffer = bytearray()
+    for row_start in range(0, len(data), width):
+        _etrle_compress_runs(runs, data, row_start, row_start + width, compressed_buffer)
+        compressed_buffer.append(0)
+    return bytes(compressed_buffer)
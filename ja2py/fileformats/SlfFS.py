@@ -19,6 +19,8 @@
 
 import os
 import io
+import re
+from fnmatch import translate
 from time import gmtime
 from calendar import timegm
 from datetime import datetime
@@ -26,6 +28,7 @@ from fs.base import FS
 from fs.errors import CreateFailedError, UnsupportedError, ResourceNotFoundError, ResourceInvalidError
 from fs.memoryfs import MemoryFS
 from fs.multifs import MultiFS
+from fs.path import abspath, normpath
 
 from .common import decode_ja2_string, encode_ja2_string, Ja2FileHeader
 
@@ -105,6 +108,12 @@ def _get_slf_filename(name_in_fs):
     return '\\'.join(name_in_fs.strip('/').split('/'))
 
 
+def _get_extension(path):
+    name = path.split('/')[-1]
+    dot = name.rfind('.')
+    return name[dot:].lower() if dot >= 0 else ''
+
+
 class SlfFS(FS):
     """
     Implements a read-only file system on top of a SLF-file
@@ -162,6 +171,28 @@ class SlfFS(FS):
                 self._path_fs.makedir(directory, recursive=True, allow_recreate=True)
                 self._path_fs.createfile('/'.join(path))
 
+        self._build_index()
+
+    def _build_index(self):
+        """
+        Maps the paths of all files to their entries and buckets the paths by extension, both in offset order
+        """
+        names = list(_get_normalized_filename(e['file_name']) for e in self.entries)
+        directories = set()
+        for name in names:
+            parts = name.split('/')
+            directories.update('/'.join(parts[:i]) for i in range(2, len(parts)))
+
+        self._entries_by_path = {}
+        for name, entry in zip(names, self.entries):
+            path = name + DIRECTORY_CONFLICT_SUFFIX if name in directories else name
+            self._entries_by_path.setdefault(path, entry)
+
+        self._paths = sorted(self._entries_by_path, key=lambda p: self._entries_by_path[p]['offset'])
+        self._paths_by_extension = {}
+        for path in self._paths:
+            self._paths_by_extension.setdefault(_get_extension(path), []).append(path)
+
     def _read_entry(self, index):
         entry_size = SlfEntry.get_size()
         self.file.seek(-entry_size * (self.header['number_of_entries'] - index), os.SEEK_END)
@@ -179,6 +210,24 @@ class SlfFS(FS):
     def listdir(self, path="/", wildcard=None, full=False, absolute=False, dirs_only=False, files_only=False):
         return self._path_fs.listdir(path, wildcard, full, absolute, dirs_only, files_only)
 
+    def query(self, pattern, regex=False):
+        """
+        Returns the absolute paths of all files matching pattern, ordered by their offset in the slf file
+
+        By default pattern is a wildcard pattern (see fnmatch) that needs to match the whole path, '*' also matches
+        across directories, e.g. '/ANIMS/*.STI'. Patterns with a literal extension only look at files with that
+        extension. With regex=True, pattern is a regular expression that needs to match at the start of the path.
+        """
+        paths = self._paths
+        if regex:
+            match = re.compile(pattern).match
+        else:
+            match = re.compile(translate(pattern)).match
+            extension = _get_extension(pattern)
+            if extension and not any(c in extension for c in '*?[]'):
+                paths = self._paths_by_extension.get(extension, [])
+        return list(p for p in paths if match(p))
+
     def open(self, path, mode='r', buffering=-1, encoding='ascii', errors=None, newline=None, line_buffering=False, **kwargs):
         if mode != 'r' and mode != 'rb':
             raise UnsupportedError(WRITING_NOT_SUPPORTED_ERROR.format('open'))
@@ -219,9 +268,7 @@ class SlfFS(FS):
         raise UnsupportedError(WRITING_NOT_SUPPORTED_ERROR.format('rename'))
 
     def _get_slf_entry_for_path(self, path):
-        if path.endswith(DIRECTORY_CONFLICT_SUFFIX):
-            path = path[:-len(DIRECTORY_CONFLICT_SUFFIX)]
-        return next(e for e in self.entries if _get_normalized_filename(e['file_name']) == path)
+        return self._entries_by_path[abspath(normpath(path))]
 
 
 class BufferedSlfFS(MultiFS):
@@ -19,13 +19,17 @@
 
 import os
 import io
+import math
 import struct
-from collections import Iterable
+import zlib
+from collections import Iterable, namedtuple
+from contextlib import contextmanager
 from PIL import Image, ImageFile, ImagePalette
 
-from .common import Ja2FileHeader
+from .common import Ja2FileHeader, signed_offset
 from ..content import Image16Bit, Images8Bit, SubImage8Bit
-from .ETRLE import etrle_decompress, etrle_compress
+from .ETRLE import EtrleDecompressor, etrle_decompress, etrle_compress_image, etrle_remap, etrle_crop, etrle_trim,\
+                   etrle_hflip
 
 
 class Sti16BitHeader(Ja2FileHeader):
@@ -114,49 +118,171 @@ class AuxObjectData(Ja2FileHeader):
     }
 
 
-def _get_filelike(file):
+StiInfo = namedtuple('StiInfo', ['kind', 'header', 'format_header'])
+
+
+@contextmanager
+def _open_filelike(file):
     if isinstance(file, str):
         filename = os.path.expanduser(os.path.expandvars(file))
         filename = os.path.normpath(os.path.abspath(filename))
-        return open(filename, 'rb')
+        with open(filename, 'rb') as f:
+            yield f
     else:
-        return file
+        yield file
 
 
-def is_16bit_sti(file):
-    f = _get_filelike(file)
-    header = StiHeader.from_bytes(f.read(StiHeader.get_size()))
-    f.seek(0, 0)
+def _read_sti_info(f):
+    header_bytes = f.read(StiHeader.get_size())
+    if len(header_bytes) != StiHeader.get_size():
+        return StiInfo(None, None, None)
+    header = StiHeader.from_bytes(header_bytes)
     if header['file_identifier'] != b'STCI':
-        return False
-    return header.get_flag('flags', 'RGB') and not header.get_flag('flags', 'INDEXED')
+        return StiInfo(None, header, None)
+
+    rgb = header.get_flag('flags', 'RGB')
+    indexed = header.get_flag('flags', 'INDEXED')
+    if rgb and not indexed:
+        return StiInfo('16bit', header, Sti16BitHeader.from_bytes(header['format_specific_header']))
+    if indexed and not rgb:
+        return StiInfo('8bit', header, Sti8BitHeader.from_bytes(header['format_specific_header']))
+    return StiInfo(None, header, None)
+
+
+def probe_sti(file):
+    """
+    Reads the header of a sti file and returns a StiInfo with the kind ('8bit', '16bit' or None for anything else),
+    the StiHeader and the format specific header.
+    A file-like object is left at the position it had before.
+    """
+    with _open_filelike(file) as f:
+        position = f.tell()
+        info = _read_sti_info(f)
+        f.seek(position, os.SEEK_SET)
+    return info
+
+
+def open_sti(file, lazy=False):
+    """
+    Loads a 8bit or 16bit sti file, the header is read only once.
+    Returns a tuple of the StiInfo and the loaded Images8Bit or Image16Bit.
+    """
+    with _open_filelike(file) as f:
+        info = _read_sti_info(f)
+        if info.kind == '8bit':
+            return info, _load_8bit_sti(f, info, lazy)
+        if info.kind == '16bit':
+            return info, _load_16bit_sti(f, info)
+    raise ValueError('Not a sti file')
+
+
+def is_16bit_sti(file):
+    return probe_sti(file).kind == '16bit'
 
 
 def is_8bit_sti(file):
-    f = _get_filelike(file)
-    header = StiHeader.from_bytes(f.read(StiHeader.get_size()))
-    f.seek(0, 0)
-    if header['file_identifier'] != b'STCI':
-        return False
-    return header.get_flag('flags', 'INDEXED') and not header.get_flag('flags', 'RGB')
+    return probe_sti(file).kind == '8bit'
+
+
+def _or_bytes(buffers, length):
+    """Combines byte strings of the given length with a bitwise or."""
+    value = 0
+    for buffer in buffers:
+        value |= int.from_bytes(buffer, 'little')
+    return value.to_bytes(length, 'little')
+
+
+def _masked_byte_tables(mask, shift, bytes_per_pixel):
+    """
+    Returns a translation table for each byte of a little endian pixel.
+    The tables map a byte to its part of `(pixel & mask) >> shift`, a negative shift shifts to the left.
+    Returns None if the result does not fit in a byte.
+    """
+    tables = []
+    for i in range(bytes_per_pixel):
+        values = [(byte << (8 * i)) & mask for byte in range(256)]
+        values = [v >> shift if shift >= 0 else v << -shift for v in values]
+        if max(values) > 255:
+            return None
+        tables.append(bytes(values))
+    return tables
+
+
+def _unpack_masked(planes, mask, shift, number_of_pixels):
+    """
+    Computes `(pixel & mask) >> shift` for all pixels at once.
+    The pixels are given as byte planes, i.e. `planes[i]` contains the i-th byte of every pixel.
+    Returns None if the result does not fit in a byte.
+    """
+    tables = _masked_byte_tables(mask, shift, len(planes))
+    if tables is None:
+        return None
+    parts = list(plane.translate(table) for plane, table in zip(planes, tables) if any(table))
+    return _or_bytes(parts, number_of_pixels)
+
+
+def _pack_pixels(components, encoders, bytes_per_pixel, number_of_pixels):
+    """
+    Packs color components into little endian pixels of bytes_per_pixel bytes.
+    `encoders[i]` maps a byte of `components[i]` to its bits in the pixel, the bits are combined with a bitwise or.
+    """
+    data = bytearray(number_of_pixels * bytes_per_pixel)
+    for i in range(bytes_per_pixel):
+        parts = []
+        for component, encode in zip(components, encoders):
+            table = bytes((encode(value) >> (8 * i)) & 0xff for value in range(256))
+            if any(table):
+                parts.append(component.translate(table))
+        if parts:
+            data[i::bytes_per_pixel] = _or_bytes(parts, number_of_pixels)
+    return data
+
+
+def _image_data_reader(f, header):
+    """
+    Returns a file-like object for the image data that starts at the current position of f and the position of the
+    data in it. The data of ZLIB sti files is inflated incrementally by an _InflatingReader, its positions are in the
+    inflated data.
+    """
+    if not header.get_flag('flags', 'ZLIB'):
+        return f, f.tell()
+    return _InflatingReader(f, f.tell(), header['size_after_compression']), 0
 
 
 def load_16bit_sti(file):
-    if not is_16bit_sti(file):
-        raise ValueError('Not a 16bit sti file')
-    f = _get_filelike(file)
+    with _open_filelike(file) as f:
+        info = _read_sti_info(f)
+        if info.kind != '16bit':
+            raise ValueError('Not a 16bit sti file')
+        return _load_16bit_sti(f, info)
+
 
-    header = StiHeader.from_bytes(f.read(StiHeader.get_size()))
-    header_16bit = Sti16BitHeader.from_bytes(header['format_specific_header'])
+def _load_16bit_sti(f, info):
+    header, header_16bit = info.header, info.format_header
 
+    size = (header['width'], header['height'])
     number_of_pixels = header['width'] * header['height']
     red_color_mask = header_16bit['red_color_mask']
     green_color_mask = header_16bit['green_color_mask']
     blue_color_mask = header_16bit['blue_color_mask']
-    pixel_bytes = struct.unpack('<{}H'.format(number_of_pixels), f.read(number_of_pixels * 2))
+    reader, _ = _image_data_reader(f, header)
+    pixel_bytes = reader.read(number_of_pixels * 2)
+    if len(pixel_bytes) != number_of_pixels * 2:
+        raise ValueError('Not enough pixel data in 16bit sti file')
+
+    planes = (pixel_bytes[0::2], pixel_bytes[1::2])
+    channels = [
+        _unpack_masked(planes, red_color_mask, 8, number_of_pixels),
+        _unpack_masked(planes, green_color_mask, 3, number_of_pixels),
+        _unpack_masked(planes, blue_color_mask, -3, number_of_pixels)
+    ]
+    if None not in channels:
+        img = Image.merge('RGB', [Image.frombytes('L', size, c) for c in channels])
+        return Image16Bit(img)
 
+    # masks that do not fit the shifts, convert pixel by pixel
     rgb_image_buffer = io.BytesIO()
-    for pixel_short in pixel_bytes:
+    for pixel_short in struct.unpack('<{}H'.format(number_of_pixels), pixel_bytes):
         r = (pixel_short & red_color_mask) >> 8
         g = (pixel_short & green_color_mask) >> 3
         b = (pixel_short & blue_color_mask) << 3
@@ -165,7 +291,7 @@ def load_16bit_sti(file):
 
     img = Image.frombytes(
         'RGB',
-        (header['width'], header['height']),
+        size,
         rgb_image_buffer.read(),
         'raw'
     )
@@ -176,18 +302,49 @@ def load_16bit_sti(file):
 def _load_raw_sub_image(f, palette, sub_image_header):
     compressed_data = f.read(sub_image_header['length'])
     uncompressed_data = etrle_decompress(compressed_data)
+    size = (sub_image_header['width'], sub_image_header['height'])
 
-    img = Image.frombytes(
-        'P',
-        (sub_image_header['width'], sub_image_header['height']),
-        uncompressed_data,
-        'raw'
-    )
+    if size[0] == 0 or size[1] == 0:
+        img = Image.new('P', size) # frombytes does not support empty images
+    else:
+        img = Image.frombytes('P', size, uncompressed_data, 'raw')
     img.putpalette(palette)
 
     return img
 
 
+class _LazySubImageFile(ImageFile.ImageFile):
+    """
+    Indexed sub image that keeps the ETRLE compressed data of a sti file.
+    The pixels are decompressed by StiImageDecoder when the image is loaded, i.e. on first use of the pixel data.
+    """
+
+    format = 'STCI'
+    format_description = "Sir-Tech's Crazy Image"
+
+    def __init__(self, compressed_data, palette, sub_image_header):
+        self._source_palette = palette
+        self._sub_image_header = sub_image_header
+        super(_LazySubImageFile, self).__init__(io.BytesIO(compressed_data))
+
+    def _open(self):
+        sub_image_header = self._sub_image_header
+        self.mode = 'P'
+        self.size = (sub_image_header['width'], sub_image_header['height'])
+        # same palette as Image.putpalette would set
+        self.palette = ImagePalette.raw(self._source_palette.rawmode, self._source_palette.palette)
+        self.palette.mode = 'RGB'
+        parameters = ('etrle', 0, sub_image_header['length'])
+        self.tile = [(self.format, (0, 0) + self.size, sub_image_header['offset'], parameters)]
+
+
+def _load_lazy_sub_image(compressed_data, palette, sub_image_header):
+    if sub_image_header['width'] == 0 or sub_image_header['height'] == 0:
+        data = compressed_data[sub_image_header['offset']:sub_image_header['offset'] + sub_image_header['length']]
+        return _load_raw_sub_image(io.BytesIO(data), palette, sub_image_header)
+    return _LazySubImageFile(compressed_data, palette, sub_image_header)
+
+
 def _to_sub_image(image, sub_image_header, aux_image_data):
     aux_data = {
         'wall_orientation': aux_image_data['wall_orientation'],
@@ -210,27 +367,65 @@ def _to_sub_image(image, sub_image_header, aux_image_data):
     )
 
 
-def load_8bit_sti(file):
-    if not is_8bit_sti(file):
-        raise ValueError('Not a non-animated 8bit sti file')
-    f = _get_filelike(file)
+def _read_8bit_sti_tables(f, header_8bit):
+    number_of_colors = header_8bit['number_of_palette_colors']
+    palette_bytes = f.read(3 * number_of_colors)
+    if len(palette_bytes) != 3 * number_of_colors:
+        raise ValueError('Not enough palette data in 8bit sti file')
+    colors_in_right_order = list(palette_bytes[0::3] + palette_bytes[1::3] + palette_bytes[2::3])
+    palette = ImagePalette.ImagePalette("RGB", colors_in_right_order, 3 * number_of_colors)
+
+    sub_image_headers_size = header_8bit['number_of_images'] * StiSubImageHeader.get_size()
+    sub_image_headers_bytes = f.read(sub_image_headers_size)
+    if len(sub_image_headers_bytes) != sub_image_headers_size:
+        raise ValueError('Not enough sub image headers in 8bit sti file')
+    sub_image_headers = StiSubImageHeader.list_from_bytes(sub_image_headers_bytes)
 
-    header = StiHeader.from_bytes(f.read(StiHeader.get_size()))
-    header_8bit = Sti8BitHeader.from_bytes(header['format_specific_header'])
+    return palette, sub_image_headers
 
-    palette_colors = [struct.unpack('BBB', f.read(3)) for _ in range(header_8bit['number_of_palette_colors'])]
-    colors_in_right_order = [x[0] for x in palette_colors] + [x[1] for x in palette_colors] + [x[2] for x in palette_colors]
-    palette = ImagePalette.ImagePalette("RGB", colors_in_right_order, 3 * header_8bit['number_of_palette_colors'])
 
-    sub_image_headers = [StiSubImageHeader.from_bytes(f.read(StiSubImageHeader.get_size()))
-                         for _ in range(header_8bit['number_of_images'])]
+def _aux_data_start(header, data_start, sub_image_headers):
+    """Returns the position of the aux object data of a 8bit sti file with the image data at data_start."""
+    if header.get_flag('flags', 'ZLIB'):
+        return data_start + header['size_after_compression']
+    return data_start + sum(s['length'] for s in sub_image_headers)
+
+
+def load_8bit_sti(file, lazy=False):
+    """
+    Loads an 8bit sti file as Images8Bit.
 
-    images = [_load_raw_sub_image(f, palette, s) for s in sub_image_headers]
+    With lazy=True the compressed data is read into memory in one piece and the pixels of each sub image are only
+    decompressed when they are first used, e.g. by `tobytes`, `getpixel`, `convert` or `save`.
+    The image data of ZLIB sti files is always inflated while loading.
+    """
+    with _open_filelike(file) as f:
+        info = _read_sti_info(f)
+        if info.kind != '8bit':
+            raise ValueError('Not a non-animated 8bit sti file')
+        return _load_8bit_sti(f, info, lazy)
+
+
+def _load_8bit_sti(f, info, lazy):
+    header, header_8bit = info.header, info.format_header
+    palette, sub_image_headers = _read_8bit_sti_tables(f, header_8bit)
+    data_start = f.tell()
+    reader, _ = _image_data_reader(f, header)
+
+    if lazy:
+        compressed_data = reader.read(sum(s['length'] for s in sub_image_headers))
+        images = [_load_lazy_sub_image(compressed_data, palette, s) for s in sub_image_headers]
+    else:
+        images = [_load_raw_sub_image(reader, palette, s) for s in sub_image_headers]
 
     aux_image_data = [None] * len(images)
     if header['aux_data_size'] != 0:
-        aux_image_data = [AuxObjectData.from_bytes(f.read(AuxObjectData.get_size()))
-                          for _ in range(header_8bit['number_of_images'])]
+        f.seek(_aux_data_start(header, data_start, sub_image_headers), os.SEEK_SET)
+        aux_data_size = header_8bit['number_of_images'] * AuxObjectData.get_size()
+        aux_data_bytes = f.read(aux_data_size)
+        if len(aux_data_bytes) != aux_data_size:
+            raise ValueError('Not enough aux object data in 8bit sti file')
+        aux_image_data = AuxObjectData.list_from_bytes(aux_data_bytes)
 
     return Images8Bit(
         list([_to_sub_image(i, s, a) for i, s, a in zip(images, sub_image_headers, aux_image_data)]),
@@ -240,6 +435,190 @@ def load_8bit_sti(file):
     )
 
 
+def load_8bit_sti_sub_images(file, indexes):
+    """
+    Loads only the sub images with the given indexes from a 8bit sti file, returns a list of SubImage8Bit.
+    Just the tables of the file are parsed, the compressed data of each sub image is read using its offset and length.
+    The image data of ZLIB sti files is inflated up to the last requested sub image.
+    """
+    with _open_filelike(file) as f:
+        info = _read_sti_info(f)
+        if info.kind != '8bit':
+            raise ValueError('Not a non-animated 8bit sti file')
+        return _load_8bit_sti_sub_images(f, info, indexes)
+
+
+def _load_8bit_sti_sub_images(f, info, indexes):
+    indexes = list(indexes) # used more than once
+    header, header_8bit = info.header, info.format_header
+    palette, sub_image_headers = _read_8bit_sti_tables(f, header_8bit)
+    data_start = f.tell()
+    reader, reader_start = _image_data_reader(f, header)
+    for index in indexes:
+        if index < 0 or index >= len(sub_image_headers):
+            raise ValueError('Sub image index {0} out of bounds'.format(index))
+
+    images = {}
+    for index in sorted(set(indexes), key=lambda i: sub_image_headers[i]['offset']):
+        reader.seek(reader_start + sub_image_headers[index]['offset'], os.SEEK_SET)
+        images[index] = _load_raw_sub_image(reader, palette, sub_image_headers[index])
+
+    aux_image_data = {}
+    if header['aux_data_size'] != 0:
+        aux_data_start = _aux_data_start(header, data_start, sub_image_headers)
+        for index in sorted(images):
+            f.seek(aux_data_start + index * AuxObjectData.get_size(), os.SEEK_SET)
+            aux_image_data[index] = AuxObjectData.from_bytes(f.read(AuxObjectData.get_size()))
+
+    return list(_to_sub_image(images[i], sub_image_headers[i], aux_image_data.get(i)) for i in indexes)
+
+
+def load_8bit_sti_sub_image(file, index):
+    return load_8bit_sti_sub_images(file, [index])[0]
+
+
+def _read_8bit_sti_parts(file):
+    """
+    Reads a 8bit sti file in parts without decoding the image data.
+    Returns a tuple of the StiInfo, the raw bytes of the headers and the palette, the sub image headers,
+    the image data and the raw bytes after the image data.
+    """
+    with _open_filelike(file) as f:
+        start = f.tell()
+        info = _read_sti_info(f)
+        if info.kind != '8bit':
+            raise ValueError('Not a 8bit sti file')
+        header, header_8bit = info.header, info.format_header
+        if header.get_flag('flags', 'ZLIB'):
+            raise ValueError('ZLIB compressed 8bit sti files are not supported')
+        palette, sub_image_headers = _read_8bit_sti_tables(f, header_8bit)
+        data_start = f.tell()
+        f.seek(start, os.SEEK_SET)
+        tables = f.read(data_start - start)
+        if sub_image_headers: # ETRLE compressed like in load_8bit_sti
+            data_size = max([s['offset'] + s['length'] for s in sub_image_headers] + [0])
+        else:
+            data_size = header['width'] * header['height']
+        data = f.read(data_size)
+        if len(data) != data_size:
+            raise ValueError('Not enough image data in 8bit sti file')
+        rest = f.read()
+    return info, tables, sub_image_headers, data, rest
+
+
+def _transform_8bit_sti(file, transform):
+    """
+    Returns the bytes of a 8bit sti file with the sub images replaced by `transform(sub_image_header, data)`.
+    The transform gets a copy of the header and the ETRLE data of a sub image and returns both after the change.
+    The new sub images are stored in order, everything else in the file stays the same.
+    """
+    info, tables, sub_image_headers, data, rest = _read_8bit_sti_parts(file)
+    if not sub_image_headers:
+        raise ValueError('No sub images in 8bit sti file')
+    view = memoryview(data)
+    new_headers = []
+    new_data = []
+    offset = 0
+    for s in sub_image_headers:
+        sub_image_header, sub_image_data = transform(
+            StiSubImageHeader(**s.field_values), view[s['offset']:s['offset'] + s['length']]
+        )
+        sub_image_header['offset'] = offset
+        sub_image_header['length'] = len(sub_image_data)
+        offset += len(sub_image_data)
+        new_headers.append(bytes(sub_image_header))
+        new_data.append(sub_image_data)
+    header = StiHeader(**info.header.field_values)
+    header['size_after_compression'] = offset
+    palette_end = StiHeader.get_size() + 3 * info.format_header['number_of_palette_colors']
+    return b''.join([bytes(header), tables[StiHeader.get_size():palette_end]] + new_headers + new_data + [rest])
+
+
+def _set_sub_image_box(sub_image_header, box):
+    """Sets the size of a sub image to the size of box and moves its offsets by the top left corner of box."""
+    x0, y0, x1, y1 = box
+    sub_image_header['offset_x'], sub_image_header['offset_y'] = _move_offsets(
+        (sub_image_header['offset_x'], sub_image_header['offset_y']), x0, y0
+    )
+    sub_image_header['width'] = x1 - x0
+    sub_image_header['height'] = y1 - y0
+
+
+def crop_8bit_sti(file, box):
+    """
+    Returns the bytes of a 8bit sti file with all sub images cropped to the rectangle box (x0, y0, x1, y1).
+    The box is relative to the point the offsets of the sub images refer to, the offsets are adjusted.
+    Sub images outside of the box become empty. The ETRLE data is cropped without decompressing it.
+    """
+    def crop(sub_image_header, data):
+        offset_x = signed_offset(sub_image_header['offset_x'])
+        offset_y = signed_offset(sub_image_header['offset_y'])
+        x0, y0 = max(box[0] - offset_x, 0), max(box[1] - offset_y, 0)
+        x1, y1 = min(box[2] - offset_x, sub_image_header['width']), min(box[3] - offset_y, sub_image_header['height'])
+        sub_image_box = (x0, y0, x1, y1) if x0 < x1 and y0 < y1 else (0, 0, 0, 0) # nothing left
+        data = etrle_crop(data, sub_image_header['width'], sub_image_header['height'], sub_image_box)
+        _set_sub_image_box(sub_image_header, sub_image_box)
+        return sub_image_header, data
+    return _transform_8bit_sti(file, crop)
+
+
+def trim_8bit_sti(file):
+    """
+    Returns the bytes of a 8bit sti file with all sub images cropped to the bounding box of their opaque pixels.
+    The offsets are adjusted, so the sub images are drawn at the same place. Fully transparent sub images are kept.
+    """
+    def trim(sub_image_header, data):
+        bbox, data = etrle_trim(data, sub_image_header['width'], sub_image_header['height'])
+        if bbox is not None:
+            _set_sub_image_box(sub_image_header, bbox)
+        return sub_image_header, data
+    return _transform_8bit_sti(file, trim)
+
+
+def hflip_8bit_sti(file):
+    """
+    Returns the bytes of a 8bit sti file with all sub images mirrored horizontally around the point the offsets
+    refer to, e.g. to create the opposite direction of an animation. The ETRLE data is mirrored row by row.
+    """
+    def hflip(sub_image_header, data):
+        width = sub_image_header['width']
+        data = etrle_hflip(data, width, sub_image_header['height'])
+        sub_image_header['offset_x'] = (-sub_image_header['offset_x'] - width) & 0xFFFF
+        return sub_image_header, data
+    return _transform_8bit_sti(file, hflip)
+
+
+def remap_8bit_sti(file, table):
+    """
+    Returns the bytes of a 8bit sti file with its palette indexes mapped through a table of 256 indexes.
+    ETRLE compressed sub images are remapped without decompressing them, see etrle_remap.
+    Files without sub images contain uncompressed indexes.
+    Everything else in the file, including the palette and the size, stays the same.
+    """
+    info, tables, sub_image_headers, data, rest = _read_8bit_sti_parts(file)
+    if sub_image_headers:
+        view = memoryview(data)
+        remapped = bytearray(data)
+        for s in sub_image_headers:
+            end = s['offset'] + s['length']
+            remapped[s['offset']:end] = etrle_remap(view[s['offset']:end], table)
+    else:
+        remapped = data.translate(bytes(table))
+    return tables + bytes(remapped) + rest
+
+
+def remap_8bit_stis(slf_fs, pattern, table):
+    """
+    Remaps all 8bit sti files of a SlfFS that match pattern (see SlfFS.query) with remap_8bit_sti.
+    Yields tuples of the path and the remapped bytes in archive order, files that are not 8bit stis are skipped.
+    """
+    for path in slf_fs.query(pattern):
+        with slf_fs.open(path, 'rb') as f:
+            if probe_sti(f).kind != '8bit':
+                continue
+            yield path, remap_8bit_sti(f, table)
+
+
 def save_16bit_sti(ja2_image, file):
     if not isinstance(ja2_image, Image16Bit):
         raise ValueError('Input needs to be of type Image16Bit')
@@ -273,43 +652,56 @@ def save_16bit_sti(ja2_image, file):
 
     file.write(bytes(header))
 
-    for y in range(height):
-        for x in range(width):
-            pix = raw_image.getpixel((x, y))
-            r = pix[0] >> 3
-            g = pix[1] >> 3
-            b = pix[2] >> 3
-            rgb = b + (g << 6) + (r << 11)
-            file.write(struct.pack('<H', rgb))
+    encoders = [
+        lambda r: (r >> 3) << 11,
+        lambda g: (g >> 3) << 6,
+        lambda b: b >> 3
+    ]
+    components = list(band.tobytes() for band in raw_image.split())
+    file.write(_pack_pixels(components, encoders, 2, width * height))
+
+
+def _sub_image_to_bytes(image):
+    width = image.size[0]
+    height = image.size[1]
+    if width == 0:
+        return height * b'\x00'
+    return etrle_compress_image(image.tobytes(), width)
 
 
-def _sub_image_to_bytes(sub_image):
-    width = sub_image.image.size[0]
-    height = sub_image.image.size[1]
-    compressed_buffer = io.BytesIO()
-    uncompressed_data = sub_image.image.tobytes()
+def _trim_image(image):
+    """
+    Crops an image to the bounding box of the pixels that are not 0, i.e. not transparent.
+    Returns the image and the top left corner of the box, fully transparent images are not cropped.
+    """
+    bbox = image.getbbox()
+    if bbox is None or bbox == (0, 0) + image.size:
+        return image, (0, 0)
+    return image.crop(bbox), bbox[:2]
 
-    for i in range(height):
-        compressed_buffer.write(etrle_compress(uncompressed_data[i*width:(i+1)*width]))
-        compressed_buffer.write(b'\x00')
-    return compressed_buffer.getvalue()
 
+def _move_offsets(offsets, x, y):
+    """Moves offsets that are stored as 16bit values."""
+    return (offsets[0] + x) & 0xFFFF, (offsets[1] + y) & 0xFFFF
 
-def _palette_to_bytes(palette):
-    buffer = io.BytesIO()
 
-    if not palette.rawmode:
-        wrong_order = palette.tobytes()
-        number_of_colors = int(len(wrong_order) / 3)
-        for i in range(number_of_colors):
-            buffer.write(wrong_order[i:i+1] + wrong_order[number_of_colors+i:number_of_colors+i+1] + wrong_order[2*number_of_colors+i:2*number_of_colors+i+1])
-    else:
-        buffer.write(palette.palette)
+def _palette_to_bytes(palette):
+    if palette.rawmode:
+        return bytes(palette.palette)
 
-    return buffer.getvalue()
+    wrong_order = palette.tobytes()
+    number_of_colors = len(wrong_order) // 3
+    colors = bytearray(3 * number_of_colors)
+    for i in range(3):
+        colors[i::3] = wrong_order[i * number_of_colors:(i + 1) * number_of_colors]
+    return bytes(colors)
 
 
-def save_8bit_sti(ja2_images, file):
+def save_8bit_sti(ja2_images, file, trim=False):
+    """
+    Saves Images8Bit as a 8bit ETRLE sti file.
+    With trim=True the sub images are cropped to their opaque pixels and the offsets are moved by the removed margins.
+    """
     if not isinstance(ja2_images, Images8Bit):
         raise ValueError('Input needs to be of type Images8Bit')
 
@@ -319,8 +711,16 @@ def save_8bit_sti(ja2_images, file):
 
     palette_bytes = _palette_to_bytes(ja2_images.palette).ljust(256 * 3, b'\x00')
 
+    images = list(s.image for s in ja2_images.images)
+    sub_image_offsets = list(s.offsets for s in ja2_images.images)
+    if trim:
+        for i, image in enumerate(images):
+            images[i], (x, y) = _trim_image(image)
+            if (x, y) != (0, 0):
+                sub_image_offsets[i] = _move_offsets(sub_image_offsets[i], x, y)
+
     initial_size = ja2_images.width * ja2_images.height
-    compressed_images = list(_sub_image_to_bytes(s) for s in ja2_images.images)
+    compressed_images = list(_sub_image_to_bytes(i) for i in images)
     compressed_image_sizes = list(len(i) for i in compressed_images)
     offsets = list(sum(compressed_image_sizes[:i]) for i in range(len(compressed_images)))
     size_after_compression = sum(compressed_image_sizes)
@@ -328,12 +728,12 @@ def save_8bit_sti(ja2_images, file):
         StiSubImageHeader(
             offset=offset,
             length=comp_size,
-            offset_x=sub.offsets[0],
-            offset_y=sub.offsets[1],
-            height=sub.image.size[1],
-            width=sub.image.size[0]
+            offset_x=sub_offsets[0],
+            offset_y=sub_offsets[1],
+            height=image.size[1],
+            width=image.size[0]
         )
-        for sub, comp_size, offset in zip(ja2_images.images, compressed_image_sizes, offsets)
+        for image, sub_offsets, comp_size, offset in zip(images, sub_image_offsets, compressed_image_sizes, offsets)
     )
 
     format_specific_header = Sti8BitHeader(
@@ -399,6 +799,54 @@ def _color_components(color, spec):
     return tuple(components)
 
 
+def _component_table(mask, bits):
+    """
+    Returns the shift and translation table that convert `(color & mask) >> shift` to a byte color component like
+    _color_components. Components of more than 8 bits keep their top 8 bits, see _mask_is_set for the colors that
+    have all bits of the mask set.
+    """
+    shift = mask.bit_length() - min(bits, 8)
+    if bits > 8:
+        return shift, bytes(range(256))
+    top = mask >> shift
+    max_value = (1 << bits) - 1
+    table = [255 if value == top else (value * 255) // max_value for value in range(max_value + 1)]
+    return shift, bytes(table + [0] * (256 - len(table)))
+
+
+def _mask_is_set(planes, mask, number_of_pixels):
+    """
+    Returns 255 for each pixel that has all bits of mask set and 0 for the others.
+    The pixels are given as byte planes like in _unpack_masked.
+    """
+    if mask >> (8 * len(planes)) != 0:
+        return bytes(number_of_pixels) # bits outside of the pixels are never set
+    value = (1 << (8 * number_of_pixels)) - 1
+    for i, plane in enumerate(planes):
+        mask_byte = (mask >> (8 * i)) & 0xff
+        if mask_byte != 0:
+            table = bytes(255 if byte & mask_byte == mask_byte else 0 for byte in range(256))
+            value &= int.from_bytes(plane.translate(table), 'little')
+    return value.to_bytes(number_of_pixels, 'little')
+
+
+def _color_components_bulk(data, spec, num_components, num_pixels):
+    """
+    Converts the raw colors of data to interleaved byte color components like _color_components does per pixel.
+    Only the first 4 bytes of each color are used.
+    """
+    bytes_per_pixel = spec[8] // 8
+    planes = [data[i::bytes_per_pixel] for i in range(min(bytes_per_pixel, 4))]
+    components = bytearray(num_pixels * num_components)
+    for i, (mask, bits) in enumerate(zip(spec[:num_components], spec[4:4 + num_components])):
+        shift, table = _component_table(mask, bits)
+        component = _unpack_masked(planes, mask, shift, num_pixels).translate(table)
+        if bits > 8: # the mask value is always pure white/opaque
+            component = _or_bytes([component, _mask_is_set(planes, mask, num_pixels)], num_pixels)
+        components[i::num_components] = component
+    return bytes(components)
+
+
 def _color_bytes(components, spec):
     """Convert color components to a byte array matching the spec."""
     masks = spec[:4]
@@ -430,6 +878,21 @@ def _color_bytes(components, spec):
         return struct.pack('<L' + 'B' * len(extra), color, *extra)
 
 
+def _component_encoder(mask):
+    """Returns a function that converts a byte color component to its bits in a color like _color_bytes."""
+    shift = mask.bit_length() - 8
+    if shift >= 0:
+        return lambda byte: (byte << shift) & mask
+    return lambda byte: (byte >> -shift) & mask
+
+
+def _color_bytes_bulk(data, spec, num_components, num_pixels):
+    """Converts interleaved byte color components to raw colors like _color_bytes does per pixel."""
+    components = [data[i::num_components] for i in range(num_components)]
+    encoders = [_component_encoder(mask) for mask in spec[:num_components]]
+    return _pack_pixels(components, encoders, spec[8] // 8, num_pixels)
+
+
 def validate_spec(spec):
     """Validates a spec with asserts."""
     assert isinstance(spec, Iterable), "spec type %r" % spec
@@ -458,12 +921,171 @@ def validate_flags(flags):
     assert len(set(flags)) == len(flags), "duplicate flags %r" % flags
 
 
+def _compression_level(encoderinfo):
+    """Returns the zlib compression level of flag 'ZLIB' or None if the data is not compressed."""
+    if 'ZLIB' not in encoderinfo['flags']:
+        return None
+    level = encoderinfo.get('compression_level', zlib.Z_DEFAULT_COMPRESSION)
+    assert isinstance(level, int) and -1 <= level <= 9, "compression_level %r" % level
+    return level
+
+
+SEMI_TRANSPARENT_ALPHA = bytes([0] + 254 * [1] + [0])
+
+
+def _to_shared_palette(image, palette, semi_transparent):
+    """
+    Converts an image to indexes of palette, which is extended with the opaque colors of the image.
+    Transparent pixels become index 0. The colors get palette indexes in order of their first appearance.
+    """
+    rgba = image.convert('RGBA')
+    width, height = rgba.size
+    if width == 0 or height == 0:
+        return b''
+    alpha = rgba.split()[3]
+    alpha_bytes = alpha.tobytes()
+    semi_transparent_pixel = alpha_bytes.translate(SEMI_TRANSPARENT_ALPHA).find(1)
+    if semi_transparent_pixel != -1:
+        if semi_transparent is None:
+            color = rgba.getpixel((semi_transparent_pixel % width, semi_transparent_pixel // width))
+            raise ValueError("semi transparent color found, set `semi_transparent` to 'transparent' or 'opaque' {}".format(color))
+        alpha = alpha.point([0] + 254 * [0 if semi_transparent == 'transparent' else 255] + [255])
+        alpha_bytes = alpha.tobytes()
+    first_opaque_pixel = alpha_bytes.find(255)
+    if first_opaque_pixel == -1:
+        return bytes(width * height)
+    # transparent pixels take the first opaque color, which does not change the order of first appearance
+    rgb = rgba.convert('RGB')
+    transparent_mask = alpha.point(lambda a: 255 - a)
+    rgb.paste(rgb.getpixel((first_opaque_pixel % width, first_opaque_pixel // width)), mask=transparent_mask)
+    if rgb.getcolors(256) is None:
+        raise ValueError("cannot allocate more than 256 colors")
+    # with at most 256 colors the median cut gives each color its own index
+    local = rgb.quantize(256)
+    local_indexes = local.tobytes()
+    local_palette = local.getpalette()
+    used = sorted((i for _, i in local.getcolors(256)), key=lambda i: local_indexes.find(i))
+    table = bytearray(256)
+    for i in used:
+        table[i] = palette.getcolor(tuple(local_palette[3 * i:3 * i + 3]))
+    indexed = Image.frombytes('L', rgba.size, local_indexes.translate(table))
+    indexed.paste(0, mask=transparent_mask)
+    return indexed.tobytes()
+
+
+class _InflatingReader(object):
+    """
+    Read-only file-like object with the inflated image data of a ZLIB sti file.
+    The compressed data is read and inflated incrementally, seeking backwards starts over.
+    """
+
+    def __init__(self, fp, offset, length):
+        self.fp = fp
+        self.offset = offset
+        self.length = length
+        self.rewind()
+
+    def rewind(self):
+        self.inflater = zlib.decompressobj()
+        self.remaining = self.length # compressed bytes not read yet
+        self.pending = b'' # inflated bytes not returned yet
+        self.position = 0
+
+    def tell(self):
+        return self.position
+
+    def seek(self, position, whence=os.SEEK_SET):
+        assert whence == os.SEEK_SET, "whence %r" % whence
+        if position < self.position:
+            self.rewind()
+        while position > self.position:
+            if not self.read(min(position - self.position, ImageFile.SAFEBLOCK)):
+                break
+        return self.position
+
+    def read(self, size=-1):
+        """Returns up to size inflated bytes, or the rest if size is negative."""
+        chunks = []
+        while size != 0:
+            if self.pending:
+                chunk = self.pending if size < 0 else self.pending[:size]
+                self.pending = self.pending[len(chunk):]
+            else:
+                data = self.inflater.unconsumed_tail
+                if not data and self.remaining > 0:
+                    self.fp.seek(self.offset + self.length - self.remaining, os.SEEK_SET)
+                    data = self.fp.read(min(self.remaining, ImageFile.SAFEBLOCK))
+                    self.remaining = self.remaining - len(data) if data else 0
+                if not data:
+                    self.pending = self.inflater.flush() # end of the compressed data
+                    if not self.pending:
+                        break
+                    continue
+                chunk = self.inflater.decompress(data, max(size, 0))
+            chunks.append(chunk)
+            self.position += len(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+
+class _DataWriter(object):
+    """
+    Write-only file-like object for the image data of a sti file.
+    The data is deflated incrementally when there is a compression level.
+    """
+
+    def __init__(self, fd, compression_level=None):
+        self.fd = fd
+        self.deflater = None if compression_level is None else zlib.compressobj(compression_level)
+        self.size = 0 # bytes written to fd
+
+    def write(self, data):
+        if self.deflater is None:
+            self._write(data)
+        else:
+            self._write(self.deflater.compress(data))
+        return len(data)
+
+    def _write(self, data):
+        self.fd.write(data)
+        self.size += len(data)
+
+    def close(self):
+        """Writes the pending compressed data and returns the number of bytes written to fd."""
+        if self.deflater is not None:
+            self._write(self.deflater.flush())
+            self.deflater = None
+        return self.size
+
+
+STI_LAYOUTS = ('row', 'grid', 'shelf')
+
+
+def open_sti_image(file, layout='row'):
+    """
+    Opens a sti file like `Image.open` and returns a StiImagePlugin image.
+    The subimages of ETRLE images are composed into frame 0 with the given layout:
+
+     * 'row' - all subimages side by side
+     * 'grid' - cells of the same size with about as many rows as columns
+     * 'shelf' - from highest to lowest in rows of about the width of a square with the same area
+
+    file is a path or a file object. A file that is opened from a path is closed like with `Image.open`.
+    """
+    return StiImagePlugin(file, layout=layout)
+
+
 class StiImagePlugin(ImageFile.ImageFile):
     """
     Image plugin for Pillow that can load STI files.
 
     Images can be RGB or INDEXED.
     INDEXED images can be encoded with ETRLE.
+    The image data can be compressed with ZLIB, the offsets of ETRLE subimages are relative to the inflated data.
+    The subimages of ETRLE images are composed into frame 0 and can be loaded individually as frames 1 to n.
+    The file of an image with several frames stays open after loading to seek to the other frames,
+    use `with Image.open(...)` or `close()` to close it.
 
     The meaning of ETRLE is unknown.
     It is a run-length encoding applied to the indexes of each line of an image.
@@ -475,14 +1097,81 @@ class StiImagePlugin(ImageFile.ImageFile):
 
     format = 'STCI'
     format_description = "Sir-Tech's Crazy Image"
+    _close_exclusive_fp_after_loading = False
+
+    def __init__(self, fp=None, filename=None, layout='row'):
+        """
+        `Image.open` uses the default layout, see open_sti_image to choose one.
+        layout is the placement of the subimages in frame 0 of ETRLE images: 'row', 'grid' or 'shelf'.
+        """
+        if layout not in STI_LAYOUTS:
+            raise ValueError('Unknown layout {0}'.format(layout))
+        self.layout = layout
+        super(StiImagePlugin, self).__init__(fp, filename)
 
     def _open(self):
         """Reads file information without image data."""
+        self._open_image()
+        # frame 0 is the image as opened, ETRLE subimages are the following frames
+        self._fp = self.fp
+        self._frame = 0
+        self._frames = [(self.size, list(self.tile))]
+        for subimage in self.info.get('subimage_headers', []):
+            size = (subimage['width'], subimage['height'])
+            parameters = ('etrle', self.info['header']['transparent_color'], subimage['length'])
+            tile = (self.format, (0, 0) + size, self._subimage_data_offset + subimage['offset'], parameters)
+            self._frames.append((size, [tile] if size[0] > 0 and size[1] > 0 else []))
+        if len(self._frames) == 1:
+            # no other frames to seek to, the file is not needed after loading
+            self._close_exclusive_fp_after_loading = True
+
+    def close(self):
+        """Closes the file, which is kept for seeking after the image is loaded."""
+        if self._exclusive_fp and self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        super(StiImagePlugin, self).close()
+
+    @property
+    def n_frames(self):
+        return len(self._frames)
+
+    @property
+    def is_animated(self):
+        return len(self._frames) > 1
+
+    def seek(self, frame):
+        """
+        Frame 0 is the image with all subimages, frame i > 0 is the ETRLE subimage i-1.
+        The info of a subimage frame contains its 'offsets', 'subimage_header' and 'aux_data' (AuxObjectData or None).
+        """
+        if frame < 0 or frame >= len(self._frames):
+            raise EOFError('attempt to seek outside sequence')
+        if frame == self._frame:
+            return
+        self._frame = frame
+        self.fp = self._fp
+        self.size, tile = self._frames[frame]
+        self.tile = list(tile)
+        self.im = Image.core.new(self.mode, self.size)
+        self.palette.mode = 'RGB'
+        self.palette.dirty = True
+        for key in ['offsets', 'subimage_header', 'aux_data']:
+            self.info.pop(key, None)
+        if frame > 0:
+            subimage = self.info['subimage_headers'][frame - 1]
+            self.info['offsets'] = (subimage['offset_x'], subimage['offset_y'])
+            self.info['subimage_header'] = subimage
+            self.info['aux_data'] = self.info['aux_object_data'][frame - 1] if 'aux_object_data' in self.info else None
+
+    def tell(self):
+        return self._frame
+
+    def _open_image(self):
         self.fp.seek(0, 0) # from start
         header = StiHeader.from_bytes(self.fp.read(StiHeader.get_size()))
         if header['file_identifier'] != b'STCI':
             raise SyntaxError('not a STCI file')
-        assert not header.get_flag('flags', 'ZLIB'), "TODO ZLIB compression" # XXX need example
         self.size = (header['width'], header['height'])
         if header.get_flag('flags', 'RGB'):
             # raw color image
@@ -498,8 +1187,9 @@ class StiImagePlugin(ImageFile.ImageFile):
                 self.mode = 'RGB'
             else:
                 self.mode = 'RGBA'
+            num_bytes = header['initial_size'] if header.get_flag('flags', 'ZLIB') else header['size_after_compression']
             self.tile = [ # single image
-                (self.format, (0, 0) + self.size, StiHeader.get_size(), ('rgb', spec, header['size_after_compression']))
+                (self.format, (0, 0) + self.size, self._data_offset(header, StiHeader.get_size()), ('rgb', spec, num_bytes))
             ]
             self.info['header'] = header
             self.info['rgb_header'] = rgb_header
@@ -517,12 +1207,12 @@ class StiImagePlugin(ImageFile.ImageFile):
             self.palette = ImagePalette.ImagePalette("RGB", raw[0::3] + raw[1::3] + raw[2::3])
             self.palette.dirty = True
             if header.get_flag('flags', 'ETRLE'): # etrle encoded indexes, multiple subimages
-                # TODO open subimages as frames instead of composing an image?
                 num_images = indexed_header['number_of_images']
                 assert num_images > 0, "TODO 0 etrle subimages" # XXX need example
                 subimage_headers = [StiSubImageHeader.from_bytes(self.fp.read(StiSubImageHeader.get_size())) for _ in range(num_images)]
                 boxes = self._generate_boxes(subimage_headers)
-                offset = self.fp.tell()
+                offset = self._data_offset(header, self.fp.tell())
+                self._subimage_data_offset = offset
                 self.tile = [
                     (self.format, (0, 0) + self.size, offset, ('fill', [header['transparent_color']])) # XXX wall index is another possibility
                 ]
@@ -539,7 +1229,7 @@ class StiImagePlugin(ImageFile.ImageFile):
             else: # raw indexes
                 assert not header.get_flag('flags', 'AUX_OBJECT_DATA'), "TODO INDEXED and AUX_OBJECT_DATA without ETRLE" # XXX need example
                 self.tile = [
-                    (self.format, (0, 0) + self.size, self.fp.tell(), ('indexes', header['width'] * header['height']))
+                    (self.format, (0, 0) + self.size, self._data_offset(header, self.fp.tell()), ('indexes', header['width'] * header['height']))
                 ]
             self.info['header'] = header
             self.info['indexed_header'] = indexed_header
@@ -547,25 +1237,80 @@ class StiImagePlugin(ImageFile.ImageFile):
         else:
             raise SyntaxError('unknown image mode')
 
+    def _data_offset(self, header, offset):
+        """
+        Returns the tile offset of the image data that starts at offset.
+        The data of ZLIB images is read through an _InflatingReader, so the tile offset is in the inflated data.
+        """
+        if not header.get_flag('flags', 'ZLIB'):
+            return offset
+        reader = _InflatingReader(self.fp, offset, header['size_after_compression'])
+        self.load_read = reader.read
+        self.load_seek = reader.seek
+        return 0
+
     def _generate_boxes(self, subimage_headers):
         """
         The main image size of indexed images seems to be the canvas size.
         STIconvert.cc has code to generate subimages by processing wall indexes (WI=255)
         At least one official STI image can't fit all subimages in the canvas, so this function resizes the image.
+        The subimages are placed according to `layout`.
         """
         assert len(subimage_headers) > 0, "TODO 0 subimages" # XXX need example
+        sizes = [(subimage['width'], subimage['height']) for subimage in subimage_headers]
+        if self.layout == 'grid':
+            boxes = self._grid_boxes(sizes)
+        elif self.layout == 'shelf':
+            boxes = self._shelf_boxes(sizes)
+        else:
+            boxes = self._row_boxes(sizes)
+        self.size = max(box[2] for box in boxes), max(box[3] for box in boxes)
+        return boxes
+
+    @staticmethod
+    def _row_boxes(sizes):
+        """All images side by side."""
         boxes = []
         width = 0
-        height = 0
-        for subimage in subimage_headers:
+        for w, h in sizes:
             if width > 0:
                 width += 1 # 1 pixel vertical line between images
-            box = (width, 0, width + subimage['width'], subimage['height'])
-            boxes.append(box)
-            width += subimage['width']
-            if height < subimage['height']:
-                height = subimage['height']
-        self.size = width, height
+            boxes.append((width, 0, width + w, h))
+            width += w
+        return boxes
+
+    @staticmethod
+    def _grid_boxes(sizes):
+        """Images in cells of the same size, with about as many rows as columns."""
+        cell_width = max(w for w, h in sizes) + 1 # 1 pixel line between cells
+        cell_height = max(h for w, h in sizes) + 1
+        columns = int(math.ceil(math.sqrt(len(sizes) * cell_height / cell_width)))
+        columns = min(max(columns, 1), len(sizes))
+        boxes = []
+        for i, (w, h) in enumerate(sizes):
+            x = (i % columns) * cell_width
+            y = (i // columns) * cell_height
+            boxes.append((x, y, x + w, y + h))
+        return boxes
+
+    @staticmethod
+    def _shelf_boxes(sizes):
+        """Images from highest to lowest in rows (shelves) of about the width of a square with the same area."""
+        area = sum((w + 1) * (h + 1) for w, h in sizes)
+        max_width = max(max(w for w, h in sizes), int(math.ceil(math.sqrt(area))))
+        boxes = [None] * len(sizes)
+        x = 0
+        y = 0
+        shelf_height = 0
+        for i in sorted(range(len(sizes)), key=lambda i: -sizes[i][1]):
+            w, h = sizes[i]
+            if x > 0 and x + w > max_width:
+                y += shelf_height + 1 # 1 pixel horizontal line between shelves
+                x = 0
+                shelf_height = 0
+            boxes[i] = (x, y, x + w, y + h)
+            x += w + 1 # 1 pixel vertical line between images
+            shelf_height = max(shelf_height, h)
         return boxes
 
     @staticmethod
@@ -575,23 +1320,25 @@ class StiImagePlugin(ImageFile.ImageFile):
 
          * flags - (list) list of flags, requires flag 'RGB'
          * spec  - (spec) optional rawmode string or spec, default is determined by StiImageEncoder, examples in RAWMODE_SPEC
+         * compression_level - (int) optional zlib compression level with flag 'ZLIB', from 0 (fastest) to 9 (smallest), default: -1
         """
         flags = img.encoderinfo['flags']
         validate_flags(flags)
         assert 'RGB' in flags
         assert 'INDEXED' not in flags
         assert 'ETRLE' not in flags
-        assert 'ZLIB' not in flags # XXX needs example
         assert 'AUX_OBJECT_DATA' not in flags # XXX needs example
         encoder = StiImageEncoder('RGB', 'colors', img.encoderinfo.get('spec'))
         spec = encoder.spec
         validate_spec(spec)
+        writer = _DataWriter(fd, _compression_level(img.encoderinfo))
         encoder.setimage(img.im)
-        encoder.setfd(fd)
+        encoder.setfd(writer)
         fd.seek(StiHeader.get_size(), 0) # from start
         num_bytes, errcode = encoder.encode_to_pyfd()
         if errcode < 0:
             raise IOError("encoder error %d when writing RGB sti image file" % errcode)
+        size_after_compression = writer.close()
         fd.truncate()
         rgb_header = Sti16BitHeader(
             red_color_mask = spec[0],
@@ -608,7 +1355,7 @@ class StiImagePlugin(ImageFile.ImageFile):
         header = StiHeader(
             file_identifier = b'STCI',
             initial_size = num_bytes,
-            size_after_compression = num_bytes,
+            size_after_compression = size_after_compression,
             transparent_color = 0,
             width = width,
             height = height,
@@ -629,13 +1376,13 @@ class StiImagePlugin(ImageFile.ImageFile):
 
          * flags - (list) list of flags
          * transparent - (list) optional transparent palette index, default: 0
+         * compression_level - (int) optional zlib compression level with flag 'ZLIB', from 0 (fastest) to 9 (smallest), default: -1
         """
         flags = img.encoderinfo['flags']
         validate_flags(flags)
         assert 'INDEXED' in flags
         assert 'ETRLE' not in flags
         assert 'RGB' not in flags
-        assert 'ZLIB' not in flags # XXX needs example
         assert 'AUX_OBJECT_DATA' not in flags # XXX needs example
         transparent = img.encoderinfo.get('transparent', 0) # XXX maybe ETRLE only?
         assert isinstance(transparent, int), "transparent %r" % transparent
@@ -643,16 +1390,20 @@ class StiImagePlugin(ImageFile.ImageFile):
         assert img.palette is not None
         # write image data
         fd.seek(StiHeader.get_size(), 0) # from start
-        data = img.palette.tobytes() # rgb bands
-        assert len(data) == 256 * 3
-        data = [x for i in range(256) for x in data[i::256]] # rgb colors
-        fd.write(bytes(data))
+        bands = img.palette.tobytes() # rgb bands
+        assert len(bands) == 256 * 3
+        data = bytearray(256 * 3) # rgb colors
+        for i in range(3):
+            data[i::3] = bands[i * 256:(i + 1) * 256]
+        fd.write(data)
+        writer = _DataWriter(fd, _compression_level(img.encoderinfo))
         encoder = StiImageEncoder('P', 'indexes')
         encoder.setimage(img.im)
-        encoder.setfd(fd)
+        encoder.setfd(writer)
         num_bytes, errcode = encoder.encode_to_pyfd()
         if errcode < 0:
             raise IOError("encoder error %d when writing INDEXED sti image file" % errcode)
+        size_after_compression = writer.close()
         fd.truncate()
         # write header
         indexed_header = Sti8BitHeader(
@@ -666,7 +1417,7 @@ class StiImagePlugin(ImageFile.ImageFile):
         header = StiHeader(
             file_identifier = b'STCI',
             initial_size = num_bytes,
-            size_after_compression = num_bytes,
+            size_after_compression = size_after_compression,
             transparent_color = transparent,
             width = width,
             height = height,
@@ -691,21 +1442,25 @@ class StiImagePlugin(ImageFile.ImageFile):
          * semi_transparent - (str) optional string indicating how to handle semi transparent pixels, default: None
            * 'transparent': make them transparent
            * 'opaque': make them opaque
+         * trim - (bool) optional, crop the images to their opaque pixels and move the offsets accordingly, default: False
          * offsets - (list) list of (x,y) offsets for each image, default: [], missing offsets default to (0,0)
          * aux_object_data - (list) optional list of AuxObjectData, default: [], missing data defaults to AuxObjectData(), re   uires flag 'AUX_OBJECT_DATA'
+         * compression_level - (int) optional zlib compression level with flag 'ZLIB', from 0 (fastest) to 9 (smallest), default: -1
         """
         flags = img.encoderinfo['flags']
         validate_flags(flags)
         assert 'INDEXED' in flags
         assert 'ETRLE' in flags
         assert 'RGB' not in flags
-        assert 'ZLIB' not in flags # XXX needs example
+        compression_level = _compression_level(img.encoderinfo)
         images = [img] + img.encoderinfo.get('append_images', [])
         num_images = len(images)
         transparent = img.encoderinfo.get('transparent')
         assert transparent is None or len(transparent) == 3, "transparent %r" % transparent
         semi_transparent = img.encoderinfo.get('semi_transparent')
         assert semi_transparent in [None, 'transparent', 'opaque'], "semi_transparent %r" % semi_transparent
+        trim = img.encoderinfo.get('trim', False)
+        assert isinstance(trim, bool), "trim %r" % trim
         offsets = img.encoderinfo.get('offsets', [])
         assert isinstance(offsets, Iterable), "offsets %r" % offsets
         if num_images > len(offsets):
@@ -720,23 +1475,7 @@ class StiImagePlugin(ImageFile.ImageFile):
         assert index == 0 # XXX assuming index 0 is transparent
         indexed = []
         for img in images:
-            data = bytearray()
-            img = img.convert('RGBA')
-            for color in img.getdata():
-                rgb = color[:3]
-                a = color[3]
-                if a != 0 and a != 255:
-                    if semi_transparent == 'transparent':
-                        a = 0
-                    elif semi_transparent == 'opaque':
-                        a = 255
-                    else:
-                        raise ValueError("semi transparent color found, set `semi_transparent` to 'transparent' or 'opaque' {}".format(color))
-                if a == 0:
-                    data.append(0) # transparent
-                else:
-                    data.append(palette.getcolor(rgb))
-            indexed.append(bytes(data))
+            indexed.append(_to_shared_palette(img, palette, semi_transparent))
         # write image data
         fd.seek(StiHeader.get_size(), 0) # from start
         palette_bands = palette.tobytes()
@@ -746,12 +1485,15 @@ class StiImagePlugin(ImageFile.ImageFile):
         compressed = []
         offset = 0
         for i in range(num_images):
-            img = Image.new('P', images[i].size)
-            img.putpalette(palette)
-            img.putdata(indexed[i])
-            data = img.tobytes(StiImagePlugin.format, 'etrle') # uses StiImageEncoder
             offset_x, offset_y = offsets[i] or (0, 0) # default offset
             width, height = images[i].size
+            if trim:
+                image, (x, y) = _trim_image(Image.frombytes('L', (width, height), indexed[i]))
+                if (x, y) != (0, 0) or image.size != (width, height):
+                    indexed[i] = image.tobytes()
+                    offset_x, offset_y = _move_offsets((offset_x, offset_y), x, y)
+                    width, height = image.size
+            data = etrle_compress_image(indexed[i], width, literal_lone_zeros=True)
             subimage_header = StiSubImageHeader(
                 offset = offset,
                 length = len(data),
@@ -763,8 +1505,10 @@ class StiImagePlugin(ImageFile.ImageFile):
             fd.write(bytes(subimage_header))
             compressed.append(data)
             offset += len(data)
+        writer = _DataWriter(fd, compression_level)
         for data in compressed:
-            fd.write(data)
+            writer.write(data)
+        size_after_compression = writer.close()
         aux_data_size = 0
         if 'AUX_OBJECT_DATA' in flags:
             data = b"".join([bytes(x or AuxObjectData()) for x in aux_object_data[:num_images]])
@@ -782,7 +1526,7 @@ class StiImagePlugin(ImageFile.ImageFile):
         header = StiHeader(
             file_identifier = b'STCI',
             initial_size = sum([len(x) for x in indexed]),
-            size_after_compression = offset,
+            size_after_compression = size_after_compression,
             transparent_color = 0, # XXX assuming palette index 0 is transparent
             width = width,
             height = height,
@@ -930,17 +1674,31 @@ class StiImageDecoder(ImageFile.PyDecoder):
             self.bytes = args[1]
             assert isinstance(self.bytes, int) and self.bytes >= 0, "number of bytes %r" % self.bytes
             assert self.mode == 'P', "mode %r" % self.mode
+            self.rawdecoder = None
         elif self.do == 'etrle':
             self.transparent = args[1]
             self.bytes = args[2]
-            assert isinstance(self.transparent, int) and self.transparent == 0, "transparent index %r" % self.transparent # XXX etrle_decompress expects index 0
+            assert isinstance(self.transparent, int) and self.transparent == 0, "transparent index %r" % self.transparent # XXX EtrleDecompressor expects index 0
             assert isinstance(self.bytes, int) and self.bytes >= 0, "number of bytes %r" % self.bytes
             assert self.mode == "P", "mode %r" % self.mode
+            self.rawdecoder = None
+            self.decompressor = EtrleDecompressor()
+            self.pending = b'' # decompressed indexes of an incomplete line
         else:
             raise NotImplementedError("decoder args {}".format(args))
 
     def decode(self, buffer):
         """Decodes buffer data as image pixels"""
+        if self.do == 'indexes': # uncompressed indexes, passed through as they arrive
+            if self.rawdecoder is None:
+                self.rawdecoder = Image._getdecoder(self.mode, 'raw', 'P')
+                self.rawdecoder.setimage(self.im, self.state.extents())
+            num_bytes, errcode = self.rawdecoder.decode(buffer)
+            if num_bytes < 0:
+                return -1, 1 # done
+            return num_bytes, 0 # get more data, unused bytes are passed again
+        if self.do == 'etrle': # etrle compressed indexes, decompressed lines are passed on as they arrive
+            return self._decode_etrle(buffer)
         # gather the target amount of data
         if self.bytes > len(buffer):
             self.data.extend(buffer)
@@ -961,34 +1719,32 @@ class StiImageDecoder(ImageFile.PyDecoder):
                 except Exception as ex:
                     print("FIXME mode %r rawmode %r failed: %r" % (self.mode, self.rawmode, ex))
             # generic python fallback
-            if bytes_per_pixel == 1:
-                colors = struct.unpack("<{}B".format(num_pixels), buffer)
-            elif bytes_per_pixel == 2:
-                colors = struct.unpack("<{}H".format(num_pixels), buffer)
-            elif bytes_per_pixel == 3:
-                colors = struct.unpack("<" + "HB" * num_pixels, buffer)
-                colors = [low + high << 16 for low, high in zip(colors[0::2], colors[1::2])]
-            else:
-                assert bytes_per_pixel >= 4 # masks are limited to 4 bytes so ignore the rest
-                colors = struct.unpack("<" + "L{}x".format(bytes_per_pixel - 4) * num_pixels, buffer)
-            assert len(colors) == num_pixels
-            num_components = len(self.mode)
-            buffer = bytes([x for color in colors for x in _color_components(color, self.spec)[:num_components]])
+            buffer = _color_components_bulk(buffer, self.spec, len(self.mode), num_pixels)
             self.set_as_raw(buffer)
             return -1, 1 # done
         elif self.do == 'fill': # color
-            buffer = bytes(self.color * num_pixels)
-            self.set_as_raw(buffer)
-            return -1, 1 # done
-        elif self.do == 'indexes': # uncompressed indexes
-            self.set_as_raw(buffer)
-            return -1, 1 # done
-        elif self.do == 'etrle': # etrle compressed indexes
-            buffer = bytes(etrle_decompress(self.data))
-            self.set_as_raw(buffer)
+            color = self.color[0] if len(self.color) == 1 else tuple(self.color)
+            x0, y0, x1, y1 = self.state.extents()
+            self.im.paste(color, (x0, y0, x1, y1)) # without a buffer for all the pixels
             return -1, 1 # done
         raise NotImplementedError("do %r", self.do)
 
+    def _decode_etrle(self, buffer):
+        """Decompresses the buffer and decodes the complete lines, the rest is kept until the next buffer."""
+        if self.rawdecoder is None:
+            self.rawdecoder = Image._getdecoder(self.mode, 'raw', 'P')
+            self.rawdecoder.setimage(self.im, self.state.extents())
+        num_bytes = min(len(buffer), self.bytes)
+        self.bytes -= num_bytes
+        data = self.pending + self.decompressor.decompress(buffer[:num_bytes] if num_bytes < len(buffer) else buffer)
+        consumed, errcode = self.rawdecoder.decode(data)
+        if consumed < 0:
+            return -1, 1 # done
+        if self.bytes == 0:
+            raise ValueError("not enough image data")
+        self.pending = data[consumed:]
+        return num_bytes, 0 # get more data
+
 
 # XXX ImageFile.PyEncoder does not exist
 class PyEncoder(object):
@@ -1142,18 +1898,16 @@ class StiImageEncoder(PyEncoder):
                 self.mode = 'RGB' # force no alpha
             else:
                 self.mode = 'RGBA' # force alpha
-            self.bytes = bytearray()
-            self.y = None
-            self.x = None
+            self.bytes = None # pending encoded bytes
+            self.offset = 0
         elif self.do == 'indexes':
             assert self.mode in ['P']
-            self.x = None
-            self.y = None
+            self.bytes = None # pending encoded bytes
+            self.offset = 0
         elif self.do == 'etrle':
             assert self.mode in ['P']
-            self.bytes = bytearray()
-            self.x = None
-            self.y = None
+            self.bytes = None # pending encoded bytes
+            self.offset = 0
         else:
             raise NotImplementedError("do %r" % self.do)
 
@@ -1185,109 +1939,56 @@ class StiImageEncoder(PyEncoder):
                 self.rawencoder = Image._getencoder(self.mode, 'raw', (self.rawmode))
                 self.rawencoder.setimage(self.im, self.state.extents())
             return self.rawencoder.encode(bufsize)
-        pixel_access = self.im.pixel_access()
-        depth = self.spec[8]
-        x0, y0, x1, y1 = self.state.extents()
-        for y in range(self.y or y0, y1):
-            for x in range(self.x or x0, x1):
-                if len(self.bytes) > bufsize:
-                    self.y = y
-                    self.x = x
-                    buffer = bytes(self.bytes[:bufsize])
-                    self.bytes = self.bytes[bufsize:]
-                    return len(buffer), 0, buffer # there is more data
-                color = pixel_access[x, y]
-                data = _color_bytes(color, self.spec)
-                self.bytes.extend(data)
-            self.x = None
-        else:
-            self.y = y1
-        if len(self.bytes) > bufsize:
-            buffer = bytes(self.bytes[:bufsize])
-            self.bytes = self.bytes[bufsize:]
+        if self.bytes is None:
+            x0, y0, x1, y1 = self.state.extents()
+            num_pixels = (x1 - x0) * (y1 - y0)
+            self.bytes = _color_bytes_bulk(self._raw_bytes(self.mode), self.spec, len(self.mode), num_pixels)
+        return self._next_chunk(bufsize)
+
+    def _raw_bytes(self, rawmode):
+        """Returns the pixels of the extents in the rawmode, encoded by Pillow's raw encoder."""
+        encoder = Image._getencoder(self.im.mode, 'raw', rawmode)
+        encoder.setimage(self.im, self.state.extents())
+        bufsize = max(ImageFile.MAXBLOCK, self.state.xsize * 4) # at least a line
+        chunks = []
+        while True:
+            num_bytes, errcode, data = encoder.encode(bufsize)
+            chunks.append(data)
+            if errcode:
+                break
+        if errcode < 0:
+            raise IOError("encoder error %d when getting raw image data" % errcode)
+        return b''.join(chunks)
+
+    def _next_chunk(self, bufsize):
+        """Returns the next chunk of at most bufsize pending bytes, the last chunk is done."""
+        pending = memoryview(self.bytes)
+        if len(self.bytes) - self.offset > bufsize:
+            buffer = bytes(pending[self.offset:self.offset + bufsize])
+            self.offset += bufsize
             return len(buffer), 0, buffer # there is more data
-        buffer = bytes(self.bytes)
-        self.bytes = self.bytes[:0]
+        buffer = bytes(pending[self.offset:])
+        self.offset = len(self.bytes)
         return len(buffer), 1, buffer # done
 
     def _encode_indexes(self, bufsize):
         """Copy palette indexes."""
         assert self.mode == 'P'
         assert self.im.mode == 'P'
-        pixel_access = self.im.pixel_access()
-        buffer = bytearray()
-        x0, y0, x1, y1 = self.state.extents()
-        for y in range(self.y or y0, y1):
-            for x in range(self.x or x0, x1):
-                if bufsize <= len(buffer):
-                    self.y = y
-                    self.x = x
-                    return len(buffer), 0, buffer # there is more data
-                index = pixel_access[x, y]
-                buffer.append(index)
-            self.x = None
-        return len(buffer), 1, buffer # done
+        if self.bytes is None:
+            self.bytes = self._raw_bytes('P')
+        return self._next_chunk(bufsize)
 
     def _encode_etrle(self, bufsize):
-        """Encode palette indexes with ETRLE."""
+        """
+        Encode palette indexes with ETRLE.
+        Lone 0's that can increase the size are left uncompressed, see etrle_compress_image.
+        """
         assert self.mode == 'P'
         assert self.im.mode == 'P'
-        pixel_access = self.im.pixel_access()
-        buffer = bytearray()
-        x0, y0, x1, y1 = self.state.extents()
-        for y in range(self.y or y0, y1):
-            if len(self.bytes) > bufsize:
-                buffer = bytes(self.bytes[:bufsize])
-                self.bytes = self.bytes[bufsize:]
-                self.y = y
-                return len(buffer), 0, buffer # there is more data
-            # process a complete line
-            line = bytearray()
-            for x in range(x0, x1):
-                index = pixel_access[x, y]
-                line.append(index)
-            while len(line) > 0:
-                control = 0 # uncompressed
-                n = len(line)
-                for i in range(1,n):
-                    # lone 0's that can increase the size are left uncompressed
-                    if line[i] != 0:
-                        continue
-                    if line[i-1] != 0:
-                        if i+1 == n:
-                            n -= 1 # uncompressed length, next cycle is compressed (lone 0 at the end)
-                            break
-                        continue
-                    if i == 1: # [0, 0, ...]
-                        control = 0x80 # compressed
-                        for i in range(2,n):
-                            if line[i] != 0:
-                                n = i
-                                break
-                    else:
-                        n = i-1 # uncompressed length, next cycle is compressed
-                    break
-                else:
-                    if n == 1 and line[0] == 0:
-                        control = 0x80 # compressed, lone 0 at the end
-                n = min(n, 0x7f) # respect maximum length
-                # encode
-                assert control in [0, 0x80]
-                assert n >= 1 and n <= 0x7f
-                self.bytes.append(control | n)
-                if control == 0:
-                    self.bytes.extend(line[:n])
-                line = line[n:]
-            self.bytes.append(0) # end of line, control with length 0
-        else:
-            self.y = y1
-        if len(self.bytes) > bufsize:
-            buffer = bytes(self.bytes[:bufsize])
-            self.bytes = self.bytes[bufsize:]
-            return len(buffer), 0, buffer # there is more data
-        buffer = bytes(self.bytes)
-        self.bytes = self.bytes[len(self.bytes):]
-        return len(buffer), 1, buffer # done
+        if self.bytes is None:
+            self.bytes = etrle_compress_image(self._raw_bytes('P'), self.state.xsize, literal_lone_zeros=True)
+        return self._next_chunk(bufsize)
 
 
 # register STI image plugin
@@ -19,7 +19,10 @@
 
 from .SlfFS import SlfFS, BufferedSlfFS, SlfEntry, SlfHeader
 from .Sti import Sti16BitHeader, Sti8BitHeader, StiHeader, StiSubImageHeader, AuxObjectData,\
-                 is_16bit_sti, is_8bit_sti, load_16bit_sti, load_8bit_sti, save_16bit_sti, save_8bit_sti
-from .ETRLE import EtrleException, etrle_compress, etrle_decompress
+                 is_16bit_sti, is_8bit_sti, load_16bit_sti, load_8bit_sti, load_8bit_sti_sub_image,\
+                 load_8bit_sti_sub_images, save_16bit_sti, save_8bit_sti, StiInfo, probe_sti, open_sti,\
+                 remap_8bit_sti, remap_8bit_stis, crop_8bit_sti, trim_8bit_sti, hflip_8bit_sti, open_sti_image
+from .ETRLE import EtrleException, EtrleDecompressor, etrle_compress, etrle_compress_image, etrle_decompress, etrle_remap,\
+                   etrle_bbox, etrle_crop, etrle_trim, etrle_hflip
 from .Gap import load_gap
-from .common import encode_ja2_string, decode_ja2_string, Ja2FileHeader
+from .common import encode_ja2_string, decode_ja2_string, signed_offset, Ja2FileHeader
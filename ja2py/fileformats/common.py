@@ -31,6 +31,11 @@ def encode_ja2_string(string, pad=None):
     return encoded
 
 
+def signed_offset(value):
+    """Returns a sub image offset, which is stored as an unsigned 16bit value but used as a signed one, as an int."""
+    return value - 0x10000 if value >= 0x8000 else value
+
+
 class Ja2FileHeader(object):
     fields = []
     flags = {}
@@ -41,7 +46,7 @@ class Ja2FileHeader(object):
             self[key] = value
 
     def __setitem__(self, key, value):
-        if key not in self.keys() or key is None:
+        if key not in self._get_key_set():
             raise KeyError('Invalid key {0}'.format(key))
         self.field_values[key] = value
 
@@ -80,15 +85,34 @@ class Ja2FileHeader(object):
     def keys(cls):
         return list([f[0] for f in cls.fields if f[0] is not None])
 
+    @classmethod
+    def _get_key_set(cls):
+        if '_key_set' not in cls.__dict__:
+            cls._key_set = frozenset(cls.keys())
+        return cls._key_set
+
     @classmethod
     def _get_struct_format(cls):
         return '<' + str.join('', map(lambda f: f[1], cls.fields))
 
+    @classmethod
+    def _get_struct(cls):
+        if '_struct' not in cls.__dict__:
+            cls._struct = struct.Struct(cls._get_struct_format())
+        return cls._struct
+
     @classmethod
     def get_size(cls):
-        return struct.calcsize(cls._get_struct_format())
+        return cls._get_struct().size
 
     @classmethod
     def from_bytes(cls, byte_str):
-        kwargs = cls.map_raw_to_attrs(dict(zip(cls.keys(), struct.unpack(cls._get_struct_format(), byte_str))))
+        kwargs = cls.map_raw_to_attrs(dict(zip(cls.keys(), cls._get_struct().unpack(byte_str))))
         return cls(**kwargs)
+
+    @classmethod
+    def list_from_bytes(cls, byte_str):
+        """Reads a list of consecutive headers, byte_str needs to be a multiple of the header size"""
+        keys = cls.keys()
+        return list(cls(**cls.map_raw_to_attrs(dict(zip(keys, values))))
+                    for values in cls._get_struct().iter_unpack(byte_str))
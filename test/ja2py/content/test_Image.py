@@ -132,6 +132,35 @@ class TestImages8Bit(unittest.TestCase):
         with self.assertRaises(ValueError):
             imgs.append(raw3)
 
+    def test_append_after_palette_change(self):
+        raws, palette = create_indexed_images()
+        imgs = Images8Bit(raws, palette)
+        original_palette = palette.tobytes()
+        palette.palette = bytearray(b'\x01\x02\x03') + palette.palette[3:]
+
+        raw3 = SubImage8Bit(Image.new('P', (2, 2)))
+        raw3.image.putpalette(palette.tobytes())
+        imgs.append(raw3)
+        self.assertEqual(len(imgs), 3)
+
+        raw4 = SubImage8Bit(Image.new('P', (2, 2)))
+        raw4.image.putpalette(original_palette)
+        with self.assertRaises(ValueError):
+            imgs.append(raw4)
+
+    def test_images_are_a_tuple_after_changes(self):
+        raws, palette = create_indexed_images()
+        imgs = Images8Bit([], palette)
+
+        imgs.append(raws[0])
+        images = imgs.images
+        imgs.append(raws[1])
+
+        self.assertEqual(images, (raws[0], ))
+        self.assertEqual(imgs.images, (raws[0], raws[1]))
+        with self.assertRaises(TypeError):
+            imgs.images[0] = raws[1]
+
     def test_insert(self):
         raws, palette = create_indexed_images()
         imgs = Images8Bit(raws, palette)
@@ -202,7 +231,32 @@ class TestImages8Bit(unittest.TestCase):
         ))
         self.assertEqual(Images8Bit(non_animated_raws, non_animated_palette).animations, None)
 
+    def test_animation_table(self):
+        raw1 = SubImage8Bit(Image.new('P', (2, 2)), aux_data={'number_of_frames': 1})
+        raw2 = SubImage8Bit(Image.new('P', (2, 2)), aux_data={'number_of_frames': 2})
+        raw3 = SubImage8Bit(Image.new('P', (2, 2)), aux_data={'number_of_frames': 0})
+        palette = ImagePalette.ImagePalette('RGB')
+
+        self.assertEqual(Images8Bit([raw1, raw2, raw3], palette).animation_table, ((0, 1), (1, 2)))
+        self.assertEqual(Images8Bit([raw3, raw2, raw3], palette).animation_table, ((0, 1), (1, 2)))
+        self.assertEqual(Images8Bit([raw3, raw3], palette).animation_table, ())
 
+    def test_animations_change_with_images(self):
+        raw1 = SubImage8Bit(Image.new('P', (2, 2)), aux_data={'number_of_frames': 2})
+        raw2 = SubImage8Bit(Image.new('P', (2, 2)), aux_data={'number_of_frames': 0})
+        raw3 = SubImage8Bit(Image.new('P', (2, 2)), aux_data={'number_of_frames': 1})
+        palette = ImagePalette.ImagePalette('RGB')
+        imgs = Images8Bit([raw1], palette)
+
+        self.assertEqual(imgs.animations, ((raw1, ), ))
 
+        imgs.append(raw2)
+        self.assertEqual(imgs.animations, ((raw1, raw2), ))
 
+        imgs.insert(0, raw3)
+        self.assertEqual(imgs.animations, ((raw3, ), (raw1, raw2)))
+        self.assertIs(imgs.animations, imgs.animations)
 
+        imgs.remove(raw3)
+        imgs.remove(raw1)
+        self.assertEqual(imgs.animations, None)
@@ -0,0 +1,218 @@
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+from io import BytesIO
+from random import Random
+from PIL import Image
+from ja2py.content import SubImage8Bit
+from ja2py.export import save_8bit_animation, write_8bit_animations
+from ja2py.fileformats import load_8bit_sti, signed_offset
+from ..fileformats.fixtures import create_8_bit_animated_sti, create_8_bit_multi_image_sti, create_16_bit_sti
+
+
+def png_chunks(data):
+    chunks = []
+    position = 8
+    while position < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[position:position + 8])
+        chunk_data = data[position + 8:position + 8 + length]
+        crc, = struct.unpack('>I', data[position + 8 + length:position + 12 + length])
+        assert crc == zlib.crc32(chunk_type + chunk_data)
+        chunks.append((chunk_type, chunk_data))
+        position += 12 + length
+    return chunks
+
+
+def lzw_decode(data, minimum_code_size):
+    clear_code = 1 << minimum_code_size
+    bits = int.from_bytes(data, 'little')
+    position = 0
+    code_size = minimum_code_size + 1
+    table = []
+    previous = None
+    output = bytearray()
+    while position + code_size <= 8 * len(data):
+        code = (bits >> position) & ((1 << code_size) - 1)
+        position += code_size
+        if code == clear_code:
+            table = list(bytes([i]) for i in range(clear_code)) + [None, None]
+            code_size = minimum_code_size + 1
+            previous = None
+            continue
+        if code == clear_code + 1:
+            break
+        if previous is None:
+            entry = table[code]
+        else:
+            entry = table[code] if code < len(table) else previous + previous[:1]
+            table.append(previous + entry[:1])
+        output += entry
+        previous = entry
+        if len(table) == 1 << code_size and code_size < 12:
+            code_size += 1
+    return bytes(output)
+
+
+def read_sub_blocks(data, position):
+    blocks = bytearray()
+    while data[position] != 0:
+        blocks += data[position + 1:position + 1 + data[position]]
+        position += 1 + data[position]
+    return bytes(blocks), position + 1
+
+
+def gif_frames(data):
+    """Decodes the (x, y, width, height, indexes, number of sub blocks) of each frame of a gif file."""
+    frames = []
+    position = 13 + 768  # header and global color table
+    while data[position] != 0x3b:
+        if data[position] == 0x21:
+            _, position = read_sub_blocks(data, position + 2)
+            continue
+        x, y, width, height, _ = struct.unpack('<HHHHB', data[position + 1:position + 10])
+        minimum_code_size = data[position + 10]
+        start = position + 11
+        lzw_data, position = read_sub_blocks(data, start)
+        frames.append((x, y, width, height, lzw_decode(lzw_data, minimum_code_size), position - start > 257))
+    return frames
+
+
+def on_canvas(size, x, y, image_size, indexes):
+    canvas = Image.new('P', size)
+    if image_size[0] and image_size[1]:
+        canvas.paste(Image.frombytes('P', image_size, indexes), (x, y))
+    return canvas.tobytes()
+
+
+class TestSave8BitAnimation(unittest.TestCase):
+    def setUp(self):
+        self.animation = load_8bit_sti(create_8_bit_animated_sti()).animations[0]
+
+    def test_apng(self):
+        output = BytesIO()
+        save_8bit_animation(self.animation, output, duration=80, loop=3)
+
+        data = output.getvalue()
+        self.assertEqual(data[:8], b'\x89PNG\r\n\x1a\n')
+        chunks = png_chunks(data)
+        self.assertEqual([t for t, _ in chunks], [b'IHDR', b'PLTE', b'tRNS', b'acTL', b'fcTL', b'IDAT', b'fcTL', b'fdAT',
+                                                  b'IEND'])
+        self.assertEqual(struct.unpack('>II', chunks[0][1][:8]), (3, 5))
+        self.assertEqual(chunks[1][1][:3], b'\x01\x02\x03')
+        self.assertEqual(struct.unpack('>II', chunks[3][1]), (2, 3))
+        self.assertEqual(struct.unpack('>IIIIIHHBB', chunks[4][1]), (0, 3, 5, 0, 0, 80, 1000, 1, 0))
+        self.assertEqual(struct.unpack('>IIIIIHHBB', chunks[6][1]), (1, 2, 3, 1, 2, 80, 1000, 1, 0))
+        self.assertEqual(struct.unpack('>I', chunks[7][1][:4]), (2,))
+        self.assertEqual(zlib.decompress(chunks[7][1][4:]), b'\x00\x01\x01\x00\x00\x00\x00\x00\x00')
+
+        with Image.open(BytesIO(data)) as image:
+            self.assertEqual(image.mode, 'P')
+            self.assertEqual(image.size, (3, 5))
+            self.assertEqual(image.info['transparency'], 0)
+            self.assertEqual(image.tobytes(), b'\x00\x01' + 13 * b'\x00')
+
+    def test_gif(self):
+        output = BytesIO()
+        save_8bit_animation(self.animation, output, format='GIF', duration=80, loop=3)
+
+        output.seek(0)
+        with Image.open(output) as image:
+            self.assertEqual(image.size, (3, 5))
+            self.assertEqual(image.info['loop'], 3)
+            self.assertEqual(image.info['duration'], 80)
+            self.assertEqual(image.info['transparency'], 0)
+            self.assertEqual(image.tile[0][1], (0, 0, 2, 1))
+            self.assertEqual(image.getpalette()[:3], [1, 2, 3])
+            self.assertEqual(image.crop((0, 0, 2, 1)).tobytes(), b'\x00\x01')
+            image.seek(1)
+            self.assertEqual(image.disposal_method, 2)
+            self.assertEqual(image.tile[0][1], (1, 2, 3, 5))
+            self.assertEqual(image.crop((1, 2, 3, 5)).tobytes(), b'\x01\x01\x00\x00\x00\x00')
+
+    def test_gif_single_column(self):
+        image = Image.frombytes('P', (1, 2), b'\x00\xc8')
+        output = BytesIO()
+        save_8bit_animation([SubImage8Bit(image)], output, format='GIF')
+
+        output.seek(0)
+        with Image.open(output) as gif:
+            self.assertEqual(gif.size, (2, 2))
+            self.assertEqual(gif.tobytes(), b'\x00\x00\xc8\x00')
+
+    def test_gif_pixels(self):
+        random = Random(4)
+        big = Image.frombytes('P', (40, 30), bytes(random.randrange(256) for _ in range(40 * 30)))
+        column = Image.frombytes('P', (1, 3), b'\x05\x00\x06')
+        small = Image.frombytes('P', (2, 2), b'\x00\x01\x02\x03')
+        sub_images = [SubImage8Bit(big, offsets=(0xfffe, 0xfffd)), SubImage8Bit(column, offsets=(37, 1)),
+                      SubImage8Bit(column, offsets=(0, 0)), SubImage8Bit(small, offsets=(5, 0xffff))]
+        output = BytesIO()
+        save_8bit_animation(sub_images, output, format='GIF')
+
+        frames = gif_frames(output.getvalue())
+        self.assertEqual(len(frames), 4)
+        self.assertTrue(frames[0][5])  # more than one sub block
+        size = struct.unpack('<HH', output.getvalue()[6:10])
+        self.assertEqual(size, (40, 30))
+        for (x, y, width, height, indexes, _), sub_image in zip(frames, sub_images):
+            self.assertEqual(len(indexes), width * height)
+            self.assertLessEqual(x + width, size[0])
+            self.assertLessEqual(y + height, size[1])
+            # the canvas starts at the offsets (-2, -3) of the first frame
+            expected_x, expected_y = signed_offset(sub_image.offsets[0]) + 2, signed_offset(sub_image.offsets[1]) + 3
+            self.assertEqual(on_canvas(size, x, y, (width, height), indexes),
+                             on_canvas(size, expected_x, expected_y, sub_image.image.size, sub_image.image.tobytes()))
+
+    def test_empty_frames(self):
+        sub_images = [SubImage8Bit(Image.new('P', (0, 3)), offsets=(5, 5)),
+                      SubImage8Bit(Image.frombytes('P', (2, 1), b'\x03\x04'), offsets=(0xffff, 0))]
+        output = BytesIO()
+        save_8bit_animation(sub_images, output)
+
+        chunks = png_chunks(output.getvalue())
+        self.assertEqual(struct.unpack('>II', chunks[0][1][:8]), (2, 1))
+        self.assertEqual(zlib.decompress(chunks[5][1]), b'\x00\x00\x00')
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            save_8bit_animation(self.animation, BytesIO(), format='WEBP')
+        with self.assertRaises(ValueError):
+            save_8bit_animation([], BytesIO())
+
+
+class TestWrite8BitAnimations(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'out')
+        self.sources = []
+        for name, create in [('anim.sti', create_8_bit_animated_sti), ('multi.sti', create_8_bit_multi_image_sti),
+                             ('rgb.sti', create_16_bit_sti)]:
+            path = os.path.join(self.directory.name, name)
+            with open(path, 'wb') as f:
+                f.write(create().read())
+            self.sources.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write(self):
+        written = write_8bit_animations(self.sources, self.output, format='GIF', duration=50, max_workers=1)
+
+        self.assertEqual(written, [os.path.join(self.output, 'anim', 'ANI0.gif')])
+        with Image.open(written[0]) as image:
+            self.assertEqual(image.info['duration'], 50)
+
+    def test_parallel_write(self):
+        written = write_8bit_animations(self.sources, self.output, max_workers=2)
+        expected = BytesIO()
+        save_8bit_animation(load_8bit_sti(self.sources[0]).animations[0], expected)
+
+        self.assertEqual(written, [os.path.join(self.output, 'anim', 'ANI0.png')])
+        with open(written[0], 'rb') as f:
+            self.assertEqual(f.read(), expected.getvalue())
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            write_8bit_animations(self.sources, self.output, format='WEBP', max_workers=1)
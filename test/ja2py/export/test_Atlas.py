@@ -0,0 +1,108 @@
+import json
+import os
+import tempfile
+import unittest
+from PIL import Image
+from ja2py.export import MaxRectsPacker, pack_rectangles, build_atlases, write_atlases
+from ..fileformats.fixtures import create_8_bit_multi_image_sti, create_16_bit_sti, create_slf_fs
+
+
+def overlaps(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+class TestMaxRectsPacker(unittest.TestCase):
+    def test_insert(self):
+        packer = MaxRectsPacker(4, 4)
+
+        self.assertEqual(packer.insert(4, 2), (0, 0))
+        self.assertEqual(packer.insert(2, 2), (0, 2))
+        self.assertEqual(packer.insert(2, 2), (2, 2))
+        self.assertEqual(packer.insert(1, 1), None)
+
+    def test_too_big(self):
+        self.assertEqual(MaxRectsPacker(4, 4).insert(5, 1), None)
+
+
+class TestPackRectangles(unittest.TestCase):
+    def test_no_overlap(self):
+        sizes = [(w, h) for w in range(1, 12, 3) for h in range(1, 20, 4)] * 3
+        positions, page_sizes = pack_rectangles(sizes, max_size=32, padding=1)
+
+        rectangles = [(page, x, y, w + 1, h + 1) for (page, x, y), (w, h) in zip(positions, sizes)]
+        for i, a in enumerate(rectangles):
+            page_width, page_height = page_sizes[a[0]]
+            self.assertLessEqual(a[1] + a[3] - 1, page_width)
+            self.assertLessEqual(a[2] + a[4] - 1, page_height)
+            for b in rectangles[i + 1:]:
+                self.assertFalse(a[0] == b[0] and overlaps(a[1:], b[1:]), '{0} {1}'.format(a, b))
+        for width, height in page_sizes:
+            self.assertEqual(width & (width - 1), 0)
+            self.assertEqual(height & (height - 1), 0)
+            self.assertLessEqual(width, 32)
+            self.assertLessEqual(height, 32)
+
+    def test_pages_are_shrunk(self):
+        positions, page_sizes = pack_rectangles([(3, 5), (2, 2)], max_size=64)
+
+        self.assertEqual(page_sizes, [(4, 8)])
+
+    def test_too_big(self):
+        with self.assertRaises(ValueError):
+            pack_rectangles([(65, 1)], max_size=64)
+
+
+class TestBuildAtlases(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.sources = []
+        for name, create in [('multi.sti', create_8_bit_multi_image_sti), ('rgb.sti', create_16_bit_sti)]:
+            path = os.path.join(self.directory.name, name)
+            with open(path, 'wb') as f:
+                f.write(create().read())
+            self.sources.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_build(self):
+        pages, manifest = build_atlases(self.sources, max_workers=1)
+
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(pages[0].mode, 'RGBA')
+        self.assertEqual([(s['source'], s['index']) for s in manifest['sprites']],
+                         [('multi', 0), ('multi', 1), ('rgb', 0)])
+        second = manifest['sprites'][1]
+        self.assertEqual((second['width'], second['height']), (2, 3))
+        self.assertEqual((second['offset_x'], second['offset_y']), (1, 2))
+        box = (second['x'], second['y'], second['x'] + 2, second['y'] + 3)
+        sprite = pages[0].crop(box)
+        self.assertEqual(list(sprite.getdata())[:2], 2 * [(4, 5, 6, 255)])
+        self.assertEqual(list(sprite.getdata(3)), 2 * [255] + 4 * [0])
+        u0, v0, u1, v1 = second['uv']
+        self.assertEqual((u0 * pages[0].size[0], v1 * pages[0].size[1]), (box[0], box[3]))
+
+    def test_parallel_build(self):
+        pages, manifest = build_atlases(self.sources, max_workers=2)
+        expected_pages, expected_manifest = build_atlases(self.sources, max_workers=1)
+
+        self.assertEqual(manifest, expected_manifest)
+        self.assertEqual(pages[0].tobytes(), expected_pages[0].tobytes())
+
+    def test_slf_sources(self):
+        slf_fs = create_slf_fs([('anims\\multi.sti', create_8_bit_multi_image_sti().getvalue())])
+        pages, manifest = build_atlases([(slf_fs, path) for path in slf_fs.walkfiles()], max_workers=1)
+
+        self.assertEqual([(s['source'], s['index']) for s in manifest['sprites']],
+                         [(os.path.join('anims', 'multi'), 0), (os.path.join('anims', 'multi'), 1)])
+
+    def test_write(self):
+        output = os.path.join(self.directory.name, 'out')
+        write_atlases(self.sources, output, name='sprites', max_workers=1)
+
+        with open(os.path.join(output, 'sprites.json'), encoding='utf8') as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest['pages'][0]['file'], 'sprites_0.png')
+        with Image.open(os.path.join(output, 'sprites_0.png')) as page:
+            self.assertEqual(page.size, (manifest['pages'][0]['width'], manifest['pages'][0]['height']))
+        self.assertEqual(len(manifest['sprites']), 3)
@@ -0,0 +1,82 @@
+import os
+import tempfile
+import unittest
+from PIL import Image
+from ja2py.export import convert_stis_to_png
+from ..fileformats.fixtures import create_8_bit_sti, create_8_bit_multi_image_sti, create_8_bit_animated_sti,\
+                                   create_16_bit_sti, create_non_image_buffer, create_slf_fs
+
+
+class TestConvertStisToPng(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.output = os.path.join(self.directory.name, 'out')
+        self.sources = []
+        for name, create in [('single.sti', create_8_bit_sti), ('multi.sti', create_8_bit_multi_image_sti),
+                             ('anim.sti', create_8_bit_animated_sti), ('rgb.sti', create_16_bit_sti)]:
+            path = os.path.join(self.directory.name, name)
+            with open(path, 'wb') as f:
+                f.write(create().read())
+            self.sources.append(path)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def relative(self, paths):
+        return list(os.path.relpath(path, self.output) for path in paths)
+
+    def test_convert(self):
+        written = convert_stis_to_png(self.sources, self.output, max_workers=1)
+
+        self.assertEqual(self.relative(written), [
+            'single.png',
+            os.path.join('multi', '0.png'),
+            os.path.join('multi', '1.png'),
+            os.path.join('anim', 'ANI0', '0.png'),
+            os.path.join('anim', 'ANI0', '1.png'),
+            'rgb.png',
+        ])
+        with Image.open(written[2]) as image:
+            self.assertEqual(image.mode, 'P')
+            self.assertEqual(image.size, (2, 3))
+            self.assertEqual(image.info['transparency'], 0)
+            self.assertEqual(list(image.getdata()), 2 * [1] + 4 * [0])
+        with Image.open(written[5]) as image:
+            self.assertEqual(image.mode, 'RGB')
+            self.assertEqual(image.size, (3, 2))
+
+    def test_chunks(self):
+        written = convert_stis_to_png(self.sources[1:2], self.output, chunk_size=1, max_workers=1)
+
+        self.assertEqual(self.relative(written), [os.path.join('multi', '0.png'), os.path.join('multi', '1.png')])
+
+    def test_parallel_convert(self):
+        written = convert_stis_to_png(self.sources, self.output, chunk_size=1, max_workers=2)
+        expected_output = os.path.join(self.directory.name, 'expected')
+        expected = convert_stis_to_png(self.sources, expected_output, max_workers=1)
+
+        self.assertEqual(self.relative(written), list(os.path.relpath(path, expected_output) for path in expected))
+        for path, expected_path in zip(written, expected):
+            with Image.open(path) as image, Image.open(expected_path) as expected_image:
+                self.assertEqual(image.tobytes(), expected_image.tobytes())
+
+    def test_compress_level(self):
+        written = convert_stis_to_png(self.sources[3:], self.output, compress_level=0, max_workers=1)
+        with Image.open(written[0]) as image:
+            self.assertEqual(image.size, (3, 2))
+
+        with self.assertRaises(ValueError):
+            convert_stis_to_png(self.sources, self.output, compress_level=10, max_workers=1)
+        with self.assertRaises(ValueError):
+            convert_stis_to_png(self.sources, self.output, chunk_size=0, max_workers=1)
+
+    def test_slf_sources(self):
+        slf_fs = create_slf_fs([
+            ('anims\\multi.sti', create_8_bit_multi_image_sti().getvalue()),
+            ('anims\\readme.txt', create_non_image_buffer().getvalue()),
+        ])
+        written = convert_stis_to_png([(slf_fs, path) for path in sorted(slf_fs.walkfiles())], self.output,
+                                      max_workers=1)
+
+        self.assertEqual(self.relative(written), [os.path.join('anims', 'multi', '0.png'),
+                                                  os.path.join('anims', 'multi', '1.png')])
@@ -1,6 +1,8 @@
+import zlib
 from io import BytesIO
+from time import strptime
 from ja2py.fileformats import Sti16BitHeader, Sti8BitHeader, StiHeader, StiSubImageHeader, AuxObjectData
-from ja2py.fileformats import etrle_compress
+from ja2py.fileformats import SlfFS, SlfHeader, SlfEntry, etrle_compress
 
 
 def create_non_image_buffer():
@@ -174,3 +176,37 @@ def create_16_bit_sti():
     data = b'\x51\x52\x53\x54\x55\x56\x57\x58\x59\x60\x61\x62'
 
     return BytesIO(bytes(header) + data)
+
+
+def create_zlib_sti(buffer):
+    """Returns a copy of a sti file with the image data compressed by ZLIB."""
+    data = buffer.getvalue()
+    header = StiHeader.from_bytes(data[:StiHeader.get_size()])
+    start = StiHeader.get_size()
+    if header.get_flag('flags', 'INDEXED'):
+        format_header = Sti8BitHeader.from_bytes(header['format_specific_header'])
+        start += 3 * format_header['number_of_palette_colors']
+        sub_image_headers_size = format_header['number_of_images'] * StiSubImageHeader.get_size()
+        sub_image_headers = StiSubImageHeader.list_from_bytes(data[start:start + sub_image_headers_size])
+        start += sub_image_headers_size
+        length = sum(s['length'] for s in sub_image_headers)
+    else:
+        length = 2 * header['width'] * header['height']
+    compressed = zlib.compress(data[start:start + length])
+    header['initial_size'] = length
+    header['size_after_compression'] = len(compressed)
+    header.set_flag('flags', 'ZLIB', True)
+
+    return BytesIO(bytes(header) + data[StiHeader.get_size():start] + compressed + data[start + length:])
+
+
+def create_slf_fs(files):
+    time = strptime('19900101T010000UTC', "%Y%m%dT%H%M%S%Z")
+    header = SlfHeader(library_name='Stis', library_path='Stis', number_of_entries=len(files), used=len(files), sort=1,
+                       version=1, contains_subdirectories=1)
+    offset = SlfHeader.get_size()
+    entries = []
+    for name, data in files:
+        entries.append(SlfEntry(file_name=name, offset=offset, length=len(data), state=1, time=time))
+        offset += len(data)
+    return SlfFS(BytesIO(bytes(header) + b''.join(d for _, d in files) + b''.join(bytes(e) for e in entries)))
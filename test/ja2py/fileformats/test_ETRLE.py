@@ -1,5 +1,6 @@
 import unittest
-from ja2py.fileformats import etrle_compress, etrle_decompress, EtrleException
+from ja2py.fileformats import etrle_compress, etrle_compress_image, etrle_decompress, EtrleException, EtrleDecompressor,\
+                              etrle_remap, etrle_bbox, etrle_crop, etrle_trim, etrle_hflip
 
 COMPRESSED_FLAG = 0x80
 MAX_COMPR_BYTES = 127
@@ -44,6 +45,22 @@ class TestEtrleDecompress(unittest.TestCase):
             etrle_decompress(bytes([0x02, 0x02]))
 
 
+class TestEtrleDecompressor(unittest.TestCase):
+    def test_chunks(self):
+        data = bytes([0x02, 0x01, 0x02, COMPRESSED_FLAG | 0x03, 0x03, 0x04, 0x05, 0x06, 0x00])
+        expected = etrle_decompress(data)
+        for chunk_size in range(1, len(data) + 1):
+            decompressor = EtrleDecompressor()
+            chunks = [decompressor.decompress(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+            self.assertEqual(b''.join(chunks) + decompressor.flush(), expected)
+
+    def test_not_enough_data(self):
+        decompressor = EtrleDecompressor()
+        self.assertEqual(decompressor.decompress(bytes([0x03, 0x02])), b'\x02')
+        with self.assertRaises(EtrleException):
+            decompressor.flush()
+
+
 class TestEtrleCompress(unittest.TestCase):
     def test_zeros(self):
         self.assertEqual(etrle_compress(3 * b'\x00'), bytes([COMPRESSED_FLAG | 3]))
@@ -69,6 +86,101 @@ class TestEtrleCompress(unittest.TestCase):
         self.assertEqual(etrle_compress(b'\x00\x01\x02\x00\x00'), b'\x81\x02\x01\x02\x82')
 
 
+class TestEtrleCompressImage(unittest.TestCase):
+    def test_rows(self):
+        self.assertEqual(etrle_compress_image(b'\x01\x02\x00\x00\x00\x03', 3), b'\x02\x01\x02\x81\x00\x82\x01\x03\x00')
+        self.assertEqual(etrle_compress_image(b'\x00\x01\x02\x00\x00', 5), b'\x81\x02\x01\x02\x82\x00')
+        self.assertEqual(etrle_compress_image(b'', 2), b'')
+
+    def test_rows_like_etrle_compress(self):
+        data = b'\x00\x01' + 130 * b'\x00' + 130 * b'\x05' + b'\x00'
+        self.assertEqual(
+            etrle_compress_image(2 * data, len(data)),
+            2 * (etrle_compress(data) + b'\x00')
+        )
+
+    def test_literal_lone_zeros(self):
+        self.assertEqual(etrle_compress_image(b'\x00\x01\x02\x00\x00', 5, True), b'\x03\x00\x01\x02\x82\x00')
+        self.assertEqual(etrle_compress_image(b'\x01\x00\x02\x00', 4, True), b'\x03\x01\x00\x02\x81\x00')
+        self.assertEqual(etrle_compress_image(b'\x00\x00\x00', 3, True), b'\x83\x00')
+        self.assertEqual(
+            etrle_compress_image((MAX_COMPR_BYTES + 1) * b'\x00' + b'\x01', MAX_COMPR_BYTES + 2, True),
+            bytes([COMPRESSED_FLAG | MAX_COMPR_BYTES, 0x02, 0x00, 0x01, 0x00])
+        )
+
+    def test_invalid_width(self):
+        with self.assertRaises(EtrleException):
+            etrle_compress_image(b'\x01\x02\x03', 2)
+        with self.assertRaises(EtrleException):
+            etrle_compress_image(b'\x01\x02\x03', 0)
+
+
+class TestEtrleRemap(unittest.TestCase):
+    def test_remap(self):
+        table = bytes([0] + list(range(255, 0, -1)))
+        data = bytes([0, 1, 2, 255, 0, 0, 0, 7] * 40)
+        compressed = etrle_compress_image(data, 20, literal_lone_zeros=True)
+        remapped = etrle_remap(compressed, table)
+
+        self.assertEqual(len(remapped), len(compressed))
+        self.assertEqual(etrle_decompress(remapped), data.translate(table))
+
+    def test_invalid_table(self):
+        with self.assertRaises(EtrleException):
+            etrle_remap(b'\x01\x02', bytes(255))
+        with self.assertRaises(EtrleException):
+            etrle_remap(b'\x01\x02', bytes(range(1, 256)) + b'\x00')
+
+    def test_not_enough_data(self):
+        with self.assertRaises(EtrleException):
+            etrle_remap(bytes([0x03, 0x02]), bytes(256))
+
+
+class TestEtrleGeometry(unittest.TestCase):
+    data = (b'\x00\x00\x00\x00\x00'
+            b'\x00\x01\x02\x00\x00'
+            b'\x00\x00\x03\x00\x00')
+
+    def test_bbox(self):
+        self.assertEqual(etrle_bbox(etrle_compress_image(self.data, 5), 5, 3), (1, 1, 3, 3))
+        self.assertEqual(etrle_bbox(etrle_compress_image(b'\x00\x01\x00\x02\x00', 5, True), 5, 1), (1, 0, 4, 1))
+        self.assertEqual(etrle_bbox(etrle_compress_image(bytes(10), 5), 5, 2), None)
+
+    def test_bbox_runs_across_rows(self):
+        self.assertEqual(etrle_bbox(etrle_compress(self.data), 5, 3), (1, 1, 3, 3))
+
+    def test_crop(self):
+        compressed = etrle_compress_image(self.data, 5)
+
+        self.assertEqual(etrle_crop(compressed, 5, 3, (1, 1, 3, 3)), etrle_compress_image(b'\x01\x02\x00\x03', 2))
+        self.assertEqual(etrle_crop(compressed, 5, 3, (0, 0, 5, 3)), compressed)
+        self.assertEqual(etrle_crop(compressed, 5, 3, (2, 0, 2, 2)), b'\x00\x00')
+        with self.assertRaises(EtrleException):
+            etrle_crop(compressed, 5, 3, (0, 0, 6, 3))
+
+    def test_trim(self):
+        compressed = etrle_compress_image(self.data, 5)
+
+        self.assertEqual(etrle_trim(compressed, 5, 3), ((1, 1, 3, 3), etrle_crop(compressed, 5, 3, (1, 1, 3, 3))))
+        self.assertEqual(etrle_trim(etrle_compress_image(bytes(4), 2), 2, 2), (None, b'\x82\x00\x82\x00'))
+
+    def test_hflip(self):
+        flipped = etrle_hflip(etrle_compress_image(self.data, 5), 5, 3)
+
+        self.assertEqual(etrle_decompress(flipped), b'\x00\x00\x00\x00\x00\x00\x00\x02\x01\x00\x00\x00\x03\x00\x00')
+
+    def test_long_runs(self):
+        data = bytes(range(1, 201)) + bytes(200)
+        compressed = etrle_compress_image(data, 200)
+
+        self.assertEqual(etrle_decompress(etrle_hflip(compressed, 200, 2)), data[199::-1] + bytes(200))
+        self.assertEqual(etrle_crop(compressed, 200, 2, (10, 0, 190, 2)), etrle_compress_image(data[10:190] + bytes(180), 180))
+
+    def test_not_enough_data(self):
+        with self.assertRaises(EtrleException):
+            etrle_bbox(etrle_compress_image(self.data, 5), 5, 4)
+
+
 class TestEtrleRoundTrip(unittest.TestCase):
     def test_decompress_compress(self):
         self.assertEqual(etrle_decompress(etrle_compress(b'\x01\x02\x03\x00')), b'\x01\x02\x03\x00')
@@ -239,6 +239,30 @@ class TestSlfFS(unittest.TestCase):
         with self.assertRaises(ResourceNotFoundError):
             slf_file.open('/foo/missing', 'r')
 
+    def test_query_wildcard(self):
+        slf_file = SlfFS(create_test_slf_fs())
+
+        self.assertEqual(slf_file.query('*.txt'), ['/spam/ham/parrot.txt', '/spam/parrot.txt'])
+        self.assertEqual(slf_file.query('/spam/*/*.txt'), ['/spam/ham/parrot.txt'])
+        self.assertEqual(slf_file.query('*.TXT'), [])
+        self.assertEqual(slf_file.query('*rrot*'), ['/spam/ham/parrot.txt', '/spam/parrot.txt', '/carrot'])
+        self.assertEqual(slf_file.query('/*'), ['/foo/bar.baz', '/spam/ham/parrot.txt', '/spam/parrot.txt', '/carrot'])
+        self.assertEqual(slf_file.query('*.ba?'), ['/foo/bar.baz'])
+
+    def test_query_regex(self):
+        slf_file = SlfFS(create_test_slf_fs())
+
+        self.assertEqual(slf_file.query(r'/spam/\w+\.txt', regex=True), ['/spam/parrot.txt'])
+        self.assertEqual(slf_file.query(r'.*rrot', regex=True), ['/spam/ham/parrot.txt', '/spam/parrot.txt', '/carrot'])
+        self.assertEqual(slf_file.query(r'rrot', regex=True), [])
+
+    def test_query_directory_conflict(self):
+        slf_file = SlfFS(create_slf_fs_with_directory_conflict())
+
+        self.assertEqual(slf_file.query('/foo*'), ['/foo/bar', '/foo_DIRECTORY_CONFLICT'])
+        with slf_file.open(slf_file.query('*CONFLICT')[0], 'rb') as f:
+            self.assertEqual(f.read(), b'Second')
+
     def test_writing_not_supported(self):
         slf_file = SlfFS(create_test_slf_fs())
 
@@ -1,8 +1,15 @@
+import os
+import tempfile
 import unittest
+import zlib
+from mock import patch
 from PIL import Image, ImagePalette
 from .fixtures import *
 from ja2py.fileformats import Sti16BitHeader, Sti8BitHeader, StiHeader, StiSubImageHeader, AuxObjectData,\
-                              is_16bit_sti, is_8bit_sti, load_16bit_sti, load_8bit_sti, save_16bit_sti, save_8bit_sti
+                              is_16bit_sti, is_8bit_sti, load_16bit_sti, load_8bit_sti, load_8bit_sti_sub_image,\
+                              load_8bit_sti_sub_images, save_16bit_sti, save_8bit_sti, probe_sti, open_sti,\
+                              remap_8bit_sti, remap_8bit_stis, crop_8bit_sti, trim_8bit_sti, hflip_8bit_sti,\
+                              open_sti_image
 from ja2py.content import Image16Bit, Images8Bit, SubImage8Bit
 from ja2py.fileformats.Sti import StiImagePlugin, StiImageEncoder, validate_spec, _color_components
 
@@ -313,6 +320,85 @@ class TestIsStiFormat(unittest.TestCase):
             self.assertEqual(truthy_fns, [expected_truthy_fn] if expected_truthy_fn else [])
 
 
+class TestProbeSti(unittest.TestCase):
+    def test_not_a_sti(self):
+        info = probe_sti(create_non_image_buffer())
+
+        self.assertEqual(info.kind, None)
+        self.assertEqual(info.format_header, None)
+
+    def test_short_file(self):
+        info = probe_sti(BytesIO(b'STCI'))
+
+        self.assertEqual(info, (None, None, None))
+
+    def test_8bit(self):
+        info = probe_sti(create_8_bit_multi_image_sti())
+
+        self.assertEqual(info.kind, '8bit')
+        self.assertEqual(info.header['width'], 8)
+        self.assertEqual(info.format_header['number_of_images'], 2)
+
+    def test_16bit(self):
+        info = probe_sti(create_16_bit_sti())
+
+        self.assertEqual(info.kind, '16bit')
+        self.assertEqual(info.header['width'], 3)
+        self.assertEqual(info.format_header['red_color_mask'], 0xF800)
+
+    def test_keeps_position(self):
+        buffer = BytesIO(b'abc' + create_8_bit_sti().read())
+        buffer.seek(3)
+
+        self.assertEqual(probe_sti(buffer).kind, '8bit')
+        self.assertEqual(buffer.tell(), 3)
+
+
+class TestOpenSti(unittest.TestCase):
+    def test_not_a_sti(self):
+        with self.assertRaises(ValueError):
+            open_sti(create_non_image_buffer())
+
+    def test_8bit(self):
+        info, sti = open_sti(create_8_bit_multi_image_sti())
+
+        self.assertEqual(info.kind, '8bit')
+        self.assertIsInstance(sti, Images8Bit)
+        self.assertEqual(len(sti), 2)
+        self.assertEqual(sti.images[1].image.tobytes(), b'\x01\x01\x00\x00\x00\x00')
+
+    def test_8bit_lazy(self):
+        info, sti = open_sti(create_8_bit_multi_image_sti(), lazy=True)
+
+        self.assertEqual(sti.images[1].image.tobytes(), b'\x01\x01\x00\x00\x00\x00')
+
+    def test_16bit(self):
+        info, sti = open_sti(create_16_bit_sti())
+
+        self.assertEqual(info.kind, '16bit')
+        self.assertIsInstance(sti, Image16Bit)
+        self.assertEqual(sti.size, (3, 2))
+
+    def test_closes_opened_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'test.sti')
+            with open(path, 'wb') as f:
+                f.write(create_8_bit_sti().read())
+
+            opened_files = []
+
+            def open_and_track(*args, **kwargs):
+                opened_files.append(open(*args, **kwargs))
+                return opened_files[-1]
+
+            with patch('ja2py.fileformats.Sti.open', create=True, side_effect=open_and_track):
+                open_sti(path)
+                self.assertEqual(probe_sti(path).kind, '8bit')
+
+            self.assertEqual(len(opened_files), 2)
+            self.assertTrue(all(f.closed for f in opened_files))
+
+
 class TestLoad16BitSti(unittest.TestCase):
     def test_not_a_16_bit_sti(self):
         with self.assertRaises(ValueError):
@@ -332,6 +418,38 @@ class TestLoad16BitSti(unittest.TestCase):
 
         self.assertEqual(img.image.tobytes(), b'PH\x88P\x88\x98P\xc8\xa8X\x08\xb8`\x08\xc8`L\x08')
 
+    def test_image_data_with_other_masks(self):
+        format_header = Sti16BitHeader(
+            red_color_mask=0x7C00,
+            green_color_mask=0x3E0,
+            blue_color_mask=0x1F,
+            alpha_channel_mask=0,
+            red_color_depth=5,
+            green_color_depth=5,
+            blue_color_depth=5,
+            alpha_channel_depth=0
+        )
+        header = StiHeader(
+            file_identifier=b'STCI',
+            initial_size=4,
+            size_after_compression=4,
+            transparent_color=0,
+            flags=4,
+            height=1,
+            width=2,
+            format_specific_header=bytes(format_header),
+            color_depth=16,
+            aux_data_size=0,
+        )
+        img = load_16bit_sti(BytesIO(bytes(header) + b'\xff\xff\x21\x04'))
+
+        self.assertEqual(img.image.tobytes(), b'\x7c\x7c\xf8' + b'\x04\x04\x08')
+
+    def test_zlib(self):
+        img = load_16bit_sti(create_zlib_sti(create_16_bit_sti()))
+
+        self.assertEqual(img.image.tobytes(), load_16bit_sti(create_16_bit_sti()).image.tobytes())
+
 
 class TestLoad8BitSti(unittest.TestCase):
     def test_not_a_8_bit_sti(self):
@@ -342,6 +460,16 @@ class TestLoad8BitSti(unittest.TestCase):
         img = load_8bit_sti(create_8_bit_multi_image_sti())
         self.assertIsInstance(img, Images8Bit)
 
+    def test_truncated_tables(self):
+        data = create_8_bit_multi_image_sti().getvalue()
+        sub_image_headers_start = StiHeader.get_size() + 6
+        with self.assertRaisesRegex(ValueError, 'sub image headers'):
+            load_8bit_sti(BytesIO(data[:sub_image_headers_start + StiSubImageHeader.get_size() + 5]))
+
+        data = create_8_bit_animated_sti().getvalue()
+        with self.assertRaisesRegex(ValueError, 'aux object data'):
+            load_8bit_sti(BytesIO(data[:-5]))
+
     def test_width_height(self):
         img = load_8bit_sti(create_8_bit_multi_image_sti())
         self.assertEqual(img.width, 8)
@@ -368,6 +496,27 @@ class TestLoad8BitSti(unittest.TestCase):
         img = load_8bit_sti(create_8_bit_multi_image_sti())
         self.assertEqual(img.images[0].image.convert('RGB').getpixel((0, 0)), (1, 2, 3))
 
+    def test_lazy(self):
+        eager = load_8bit_sti(create_8_bit_multi_image_sti())
+        lazy = load_8bit_sti(create_8_bit_multi_image_sti(), lazy=True)
+
+        self.assertEqual(len(lazy), 2)
+        self.assertEqual(lazy.images[1].offsets, (1, 2))
+        for eager_sub_image, lazy_sub_image in zip(eager.images, lazy.images):
+            self.assertEqual(lazy_sub_image.image.mode, 'P')
+            self.assertEqual(lazy_sub_image.image.size, eager_sub_image.image.size)
+            self.assertEqual(lazy_sub_image.image.tobytes(), eager_sub_image.image.tobytes())
+            self.assertEqual(lazy_sub_image.image.convert('RGB').tobytes(),
+                             eager_sub_image.image.convert('RGB').tobytes())
+
+    def test_lazy_decompresses_on_first_use(self):
+        img = load_8bit_sti(create_8_bit_multi_image_sti(), lazy=True)
+        sub_image = img.images[1].image
+
+        self.assertEqual(len(sub_image.tile), 1)
+        self.assertEqual(sub_image.getpixel((0, 0)), 1)
+        self.assertEqual(sub_image.tile, [])
+
     def test_aux_object_data(self):
         img = load_8bit_sti(create_8_bit_animated_sti())
 
@@ -398,6 +547,160 @@ class TestLoad8BitSti(unittest.TestCase):
             'uses_land_z': False,
         })
 
+    def test_zlib(self):
+        for create in [create_8_bit_multi_image_sti, create_8_bit_animated_sti]:
+            expected = load_8bit_sti(create())
+            for lazy in [False, True]:
+                img = load_8bit_sti(create_zlib_sti(create()), lazy=lazy)
+
+                self.assertEqual(len(img), len(expected))
+                for sub_image, expected_sub_image in zip(img.images, expected.images):
+                    self.assertEqual(sub_image.offsets, expected_sub_image.offsets)
+                    self.assertEqual(sub_image.aux_data, expected_sub_image.aux_data)
+                    self.assertEqual(sub_image.image.tobytes(), expected_sub_image.image.tobytes())
+
+
+class TestLoad8BitStiSubImages(unittest.TestCase):
+    def test_not_a_8_bit_sti(self):
+        with self.assertRaises(ValueError):
+            load_8bit_sti_sub_image(create_non_image_buffer(), 0)
+
+    def test_index_out_of_bounds(self):
+        with self.assertRaises(ValueError):
+            load_8bit_sti_sub_image(create_8_bit_multi_image_sti(), 2)
+        with self.assertRaises(ValueError):
+            load_8bit_sti_sub_images(create_8_bit_multi_image_sti(), [0, -1])
+
+    def test_single_sub_image(self):
+        sub_image = load_8bit_sti_sub_image(create_8_bit_multi_image_sti(), 1)
+        expected = load_8bit_sti(create_8_bit_multi_image_sti()).images[1]
+
+        self.assertIsInstance(sub_image, SubImage8Bit)
+        self.assertEqual(sub_image.offsets, (1, 2))
+        self.assertEqual(sub_image.aux_data, None)
+        self.assertEqual(sub_image.image.size, (2, 3))
+        self.assertEqual(sub_image.image.tobytes(), expected.image.tobytes())
+        self.assertEqual(sub_image.image.convert('RGB').getpixel((0, 0)), (4, 5, 6))
+
+    def test_multiple_sub_images_keep_order(self):
+        sub_images = load_8bit_sti_sub_images(create_8_bit_multi_image_sti(), [1, 0, 1])
+        expected = load_8bit_sti(create_8_bit_multi_image_sti()).images
+
+        self.assertEqual(len(sub_images), 3)
+        for sub_image, index in zip(sub_images, [1, 0, 1]):
+            self.assertEqual(sub_image.offsets, expected[index].offsets)
+            self.assertEqual(sub_image.image.tobytes(), expected[index].image.tobytes())
+
+    def test_generator_indexes(self):
+        sub_images = load_8bit_sti_sub_images(create_8_bit_multi_image_sti(), (i for i in [1, 0]))
+
+        self.assertEqual([s.offsets for s in sub_images], [(1, 2), (0, 0)])
+
+    def test_aux_object_data(self):
+        sub_image = load_8bit_sti_sub_image(create_8_bit_animated_sti(), 1)
+
+        self.assertEqual(sub_image.aux_data['current_frame'], 1)
+        self.assertEqual(sub_image.aux_data['number_of_frames'], 0)
+
+    def test_zlib(self):
+        sub_images = load_8bit_sti_sub_images(create_zlib_sti(create_8_bit_animated_sti()), [1, 0])
+        expected = load_8bit_sti(create_8_bit_animated_sti()).images
+
+        for sub_image, index in zip(sub_images, [1, 0]):
+            self.assertEqual(sub_image.offsets, expected[index].offsets)
+            self.assertEqual(sub_image.aux_data, expected[index].aux_data)
+            self.assertEqual(sub_image.image.tobytes(), expected[index].image.tobytes())
+
+
+class TestRemap8BitSti(unittest.TestCase):
+    table = bytes([0] + list(range(2, 256)) + [1])
+
+    def test_not_a_8_bit_sti(self):
+        with self.assertRaises(ValueError):
+            remap_8bit_sti(create_16_bit_sti(), self.table)
+
+    def test_remap(self):
+        original = create_8_bit_animated_sti().getvalue()
+        remapped = remap_8bit_sti(create_8_bit_animated_sti(), self.table)
+        expected = load_8bit_sti(BytesIO(original))
+        images = load_8bit_sti(BytesIO(remapped))
+
+        self.assertEqual(len(remapped), len(original))
+        self.assertEqual(images.palette.palette, expected.palette.palette)
+        for image, expected_image in zip(images.images, expected.images):
+            self.assertEqual(image.offsets, expected_image.offsets)
+            self.assertEqual(image.aux_data, expected_image.aux_data)
+            self.assertEqual(image.image.tobytes(), expected_image.image.tobytes().translate(self.table))
+
+    def test_remap_raw_indexes(self):
+        img = Image.new('P', (3, 1))
+        img.putdata([0, 1, 255])
+        buf = BytesIO()
+        img.save(buf, format=StiImagePlugin.format, flags=['INDEXED'])
+        sti = Image.open(BytesIO(remap_8bit_sti(BytesIO(buf.getvalue()), self.table)))
+
+        self.assertEqual(list(sti.getdata()), [0, 2, 1])
+
+    def test_remap_stis(self):
+        slf_fs = create_slf_fs([
+            ('a.sti', create_8_bit_multi_image_sti().getvalue()),
+            ('b.sti', create_16_bit_sti().getvalue()),
+            ('c.txt', b'text'),
+            ('d.sti', create_8_bit_sti().getvalue()),
+        ])
+        remapped = list(remap_8bit_stis(slf_fs, '*.sti', self.table))
+
+        self.assertEqual([path for path, _ in remapped], ['/a.sti', '/d.sti'])
+        self.assertEqual(remapped[1][1], remap_8bit_sti(create_8_bit_sti(), self.table))
+
+
+class TestGeometry8BitSti(unittest.TestCase):
+    def setUp(self):
+        img1 = Image.new('RGB', (4, 3))
+        img1.putpixel((1, 1), (5, 5, 5))
+        img1.putpixel((2, 2), (6, 6, 6))
+        img2 = Image.new('RGB', (2, 2), (7, 7, 7))
+        buf = BytesIO()
+        img1.save(buf, format=StiImagePlugin.format, save_all=True, append_images=[img2],
+                  offsets=[(0xfffd, 0xfffb), (1, 1)])
+        self.data = buf.getvalue()
+        self.images = load_8bit_sti(BytesIO(self.data))
+
+    def test_trim(self):
+        images = load_8bit_sti(BytesIO(trim_8bit_sti(BytesIO(self.data))))
+
+        self.assertEqual(images.images[0].offsets, (0xfffe, 0xfffc))
+        self.assertEqual(images.images[0].image.tobytes(), self.images.images[0].image.crop((1, 1, 3, 3)).tobytes())
+        self.assertEqual(images.images[1].offsets, (1, 1))
+        self.assertEqual(images.images[1].image.tobytes(), self.images.images[1].image.tobytes())
+        self.assertEqual(images.palette.palette, self.images.palette.palette)
+
+    def test_crop(self):
+        images = load_8bit_sti(BytesIO(crop_8bit_sti(BytesIO(self.data), (-2, -5, 2, -3))))
+
+        self.assertEqual(images.images[0].offsets, (0xfffe, 0xfffb))
+        self.assertEqual(images.images[0].image.tobytes(), self.images.images[0].image.crop((1, 0, 4, 2)).tobytes())
+        self.assertEqual(images.images[1].offsets, (1, 1))
+        self.assertEqual(images.images[1].image.size, (0, 0))
+
+    def test_hflip(self):
+        images = load_8bit_sti(BytesIO(hflip_8bit_sti(BytesIO(self.data))))
+
+        self.assertEqual(images.images[0].offsets, (0xffff, 0xfffb))
+        self.assertEqual(images.images[1].offsets, (0xfffd, 1))
+        for image, expected in zip(images.images, self.images.images):
+            self.assertEqual(image.image.tobytes(), expected.image.transpose(Image.FLIP_LEFT_RIGHT).tobytes())
+
+    def test_aux_data_is_kept(self):
+        original = create_8_bit_animated_sti().getvalue()
+        images = load_8bit_sti(BytesIO(hflip_8bit_sti(create_8_bit_animated_sti())))
+
+        self.assertEqual([i.aux_data for i in images.images], [i.aux_data for i in load_8bit_sti(BytesIO(original)).images])
+
+    def test_not_a_8_bit_sti(self):
+        with self.assertRaises(ValueError):
+            trim_8bit_sti(create_16_bit_sti())
+
 
 class TestWrite16BitSti(unittest.TestCase):
     def test_write(self):
@@ -415,6 +718,15 @@ class TestWrite16BitSti(unittest.TestCase):
 
                          )
 
+    def test_write_pixel_data(self):
+        raw = Image.new('RGB', (2, 1))
+        raw.putdata([(0x08, 0x10, 0x18), (0xff, 0xff, 0xff)])
+        buffer = BytesIO()
+
+        save_16bit_sti(Image16Bit(raw), buffer)
+
+        self.assertEqual(buffer.getvalue()[StiHeader.get_size():], b'\x83\x08' + b'\xdf\xff')
+
     def test_write_with_wrong_type(self):
         img = {}
         buffer = BytesIO()
@@ -455,6 +767,26 @@ class TestWrite8BitSti(unittest.TestCase):
                          # Data
                          b'\x02\x01\x01\x00\x02\x01\x01\x00')
 
+    def test_write_with_trim(self):
+        palette = ImagePalette.ImagePalette('RGB', b'\x01\x02\x03\x04\x05\x06', 6)
+        image = Image.new('P', (5, 4))
+        image.putpixel((1, 2), 1)
+        image.putpixel((3, 2), 1)
+        empty = Image.new('P', (2, 2))
+        for i in [image, empty]:
+            i.putpalette(palette)
+        imgs = Images8Bit([SubImage8Bit(image, offsets=(10, 20)), SubImage8Bit(empty, offsets=(1, 1))],
+                          palette=palette, width=9, height=8)
+        buffer = BytesIO()
+
+        save_8bit_sti(imgs, buffer, trim=True)
+        trimmed = load_8bit_sti(BytesIO(buffer.getvalue()))
+
+        self.assertEqual(trimmed.images[0].offsets, (11, 22))
+        self.assertEqual(trimmed.images[0].image.tobytes(), b'\x01\x00\x01')
+        self.assertEqual(trimmed.images[1].offsets, (1, 1))
+        self.assertEqual(trimmed.images[1].image.size, (2, 2))
+
     def test_write_with_raw_palette(self):
         palette = ImagePalette.raw('RGB', b'\x01\x02\x03\x04\x05\x06')
         img = SubImage8Bit(Image.new('P', (2, 2), color=1))
@@ -648,6 +980,54 @@ class TestStiImagePlugin(unittest.TestCase):
         img.save(buf, format=StiImagePlugin.format, flags=['RGB'], spec=spec)
         self.assertEqual(buf.getvalue(), data)
 
+    def test_open_save_colors_without_rawmode(self):
+        data = [(1, 2, 3), (4, 5, 6), (255, 0, 128), (7, 8, 9)]
+        for spec, expected in [
+            ('RGBX', b'\x01\x02\x03\x00\x04\x05\x06\x00\xff\x00\x80\x00\x07\x08\x09\x00'),
+            ((0x00ff00, 0x0000ff, 0xff0000, 0, 8, 8, 8, 0, 24), b'\x02\x01\x03\x05\x04\x06\x00\xff\x80\x08\x07\x09'),
+        ]:
+            img = Image.new('RGB', (2, 2))
+            img.putdata(data)
+            buf = BytesIO()
+            img.save(buf, format=StiImagePlugin.format, flags=['RGB'], spec=spec)
+            self.assertEqual(buf.getvalue()[StiHeader.get_size():], expected)
+            img = Image.open(buf)
+            self.assertEqual(img.mode, 'RGB')
+            self.assertEqual(list(img.getdata()), data)
+
+    def test_open_colors_wide_masks(self):
+        # masks of more than 8 bits with gaps in their top 8 bits
+        for spec in [(0xfdc0, 0x3e, 0x1, 0, 10, 5, 1, 0, 16), (0xffdfc000, 0x3e00, 0x1ff, 0, 18, 5, 9, 0, 32)]:
+            rgb_header = Sti16BitHeader(
+                red_color_mask = spec[0],
+                green_color_mask = spec[1],
+                blue_color_mask = spec[2],
+                alpha_channel_mask = spec[3],
+                red_color_depth = spec[4],
+                green_color_depth = spec[5],
+                blue_color_depth = spec[6],
+                alpha_channel_depth = spec[7],
+            )
+            colors = [0, spec[0], spec[0] | spec[1] | spec[2], spec[0] ^ 0x4000, 0x12345678 & ((1 << spec[8]) - 1)]
+            image_data = b''.join(color.to_bytes(spec[8] // 8, 'little') for color in colors)
+            header = StiHeader(
+                file_identifier = b'STCI',
+                initial_size = len(image_data),
+                size_after_compression = len(image_data),
+                transparent_color = 0,
+                flags = 0,
+                height = 1,
+                width = len(colors),
+                format_specific_header = bytes(rgb_header),
+                color_depth = spec[8],
+                aux_data_size = 0,
+            )
+            header.set_flag('flags', 'RGB', True)
+            img = Image.open(BytesIO(bytes(header) + image_data))
+
+            self.assertEqual(list(img.getdata()), [_color_components(color, spec)[:3] for color in colors])
+            self.assertEqual(img.getpixel((2, 0)), (255, 255, 255))
+
     def test_open_save_indexes(self):
         indexed_header = Sti8BitHeader(
             number_of_palette_colors = 256,
@@ -685,6 +1065,18 @@ class TestStiImagePlugin(unittest.TestCase):
         img.save(buf, format=StiImagePlugin.format, flags=['INDEXED'])
         self.assertEqual(buf.getvalue(), data)
 
+    def test_open_save_large_indexes(self):
+        img = Image.new('P', (301, 300))
+        img.putdata([i % 251 for i in range(301 * 300)])
+        img.putpalette(bytes(range(256)) * 3)
+        buf = BytesIO()
+        img.save(buf, format=StiImagePlugin.format, flags=['INDEXED'])
+        self.assertEqual(buf.getvalue()[StiHeader.get_size() + 256 * 3:], img.tobytes())
+        buf.seek(0)
+        sti = Image.open(buf)
+        self.assertEqual(sti.tobytes(), img.tobytes())
+        self.assertEqual(sti.palette.tobytes(), bytes(range(256)) * 3)
+
     def test_open_save_etrle(self):
         indexed_header = Sti8BitHeader(
             number_of_palette_colors=256,
@@ -749,6 +1141,282 @@ class TestStiImagePlugin(unittest.TestCase):
             img = sti.crop(box).convert(original.mode)
             self.assertEqual(list(img.getdata()), list(original.getdata()))
 
+    def test_etrle_frames(self):
+        img1 = Image.new('RGB', (2, 3), (1, 2, 3))
+        img2 = Image.new('RGB', (4, 1), (3, 2, 1))
+        aux_object_data = [
+            AuxObjectData(wall_orientation=0, number_of_tiles=0, tile_location_index=0, current_frame=0,
+                          number_of_frames=2, flags=0),
+            AuxObjectData(wall_orientation=0, number_of_tiles=0, tile_location_index=0, current_frame=1,
+                          number_of_frames=0, flags=0),
+        ]
+        buf = BytesIO()
+        img1.save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE', 'AUX_OBJECT_DATA'],
+                  append_images=[img2], offsets=[(1, 2)], aux_object_data=aux_object_data)
+        sti = Image.open(buf)
+
+        self.assertEqual(sti.n_frames, 3)
+        self.assertTrue(sti.is_animated)
+        self.assertEqual(sti.tell(), 0)
+        self.assertEqual(sti.size, (7, 3))
+        self.assertNotIn('offsets', sti.info)
+
+        sti.seek(2)
+        self.assertEqual(sti.tell(), 2)
+        self.assertEqual(sti.size, (4, 1))
+        self.assertEqual(sti.info['offsets'], (0, 0))
+        self.assertEqual(sti.info['aux_data']['current_frame'], 1)
+        self.assertEqual(list(sti.convert('RGB').getdata()), 4 * [(3, 2, 1)])
+
+        sti.seek(1)
+        self.assertEqual(sti.size, (2, 3))
+        self.assertEqual(sti.info['offsets'], (1, 2))
+        self.assertEqual(sti.info['subimage_header']['width'], 2)
+        self.assertEqual(sti.info['aux_data']['number_of_frames'], 2)
+        self.assertEqual(list(sti.convert('RGB').getdata()), 6 * [(1, 2, 3)])
+
+        sti.seek(0)
+        self.assertEqual(sti.size, (7, 3))
+        self.assertEqual(sti.convert('RGB').getpixel((3, 0)), (3, 2, 1))
+
+        with self.assertRaises(EOFError):
+            sti.seek(3)
+
+    def test_open_zlib(self):
+        indexed_header = Sti8BitHeader(
+            number_of_palette_colors = 256,
+            number_of_images = 2,
+            red_color_depth = 8,
+            green_color_depth = 8,
+            blue_color_depth = 8
+        )
+        subimage_data = [b'\x02\x01\x02\x00', b'\x81\x01\x03\x00']
+        compressed = zlib.compress(b''.join(subimage_data))
+        header = StiHeader(
+            file_identifier = b'STCI',
+            initial_size = 4,
+            size_after_compression = len(compressed),
+            transparent_color = 0,
+            flags = 0,
+            height = 1,
+            width = 2,
+            format_specific_header = bytes(indexed_header),
+            color_depth = 8,
+            aux_data_size = 0,
+        )
+        for flag in ['INDEXED', 'ETRLE', 'ZLIB']:
+            header.set_flag('flags', flag, True)
+        palette_colors = bytes([i for i in range(256) for _ in range(3)])
+        subimage_headers = [
+            StiSubImageHeader(offset=0, length=4, offset_x=0, offset_y=0, height=1, width=2),
+            StiSubImageHeader(offset=4, length=4, offset_x=0, offset_y=0, height=1, width=2),
+        ]
+        data = bytes(header) + palette_colors + b''.join(bytes(x) for x in subimage_headers) + compressed
+        sti = Image.open(BytesIO(data))
+
+        self.assertEqual(list(sti.getdata()), [1, 2, 0, 0, 3])
+        sti.seek(2)
+        self.assertEqual(list(sti.getdata()), [0, 3])
+        sti.seek(1)
+        self.assertEqual(list(sti.getdata()), [1, 2])
+
+    def test_open_save_zlib(self):
+        rgb = Image.new('RGB', (301, 300))
+        rgb.putdata([(i % 256, i % 7, i % 251) for i in range(301 * 300)])
+        indexed = Image.new('P', (301, 300))
+        indexed.putdata([i % 7 for i in range(301 * 300)])
+        indexed.putpalette(bytes(range(256)) * 3)
+        for img, flags, mode in [(rgb, ['RGB'], 'RGB'), (indexed, ['INDEXED'], 'P'), (indexed, ['INDEXED', 'ETRLE'], 'RGB')]:
+            flags = flags + ['ZLIB']
+            buf = BytesIO()
+            img.save(buf, format=StiImagePlugin.format, flags=flags, spec='RGB')
+            sti = Image.open(buf)
+            header = sti.info['header']
+            self.assertTrue(header.get_flag('flags', 'ZLIB'))
+            self.assertLess(header['size_after_compression'], header['initial_size'])
+            self.assertEqual(sti.convert(mode).tobytes(), img.convert(mode).tobytes())
+
+    def test_save_zlib_compression_level(self):
+        img = Image.new('RGB', (64, 64))
+        img.putdata([(i % 256, i % 3, 0) for i in range(64 * 64)])
+        sizes = []
+        for compression_level in [0, 9]:
+            buf = BytesIO()
+            img.save(buf, format=StiImagePlugin.format, flags=['RGB', 'ZLIB'], spec='RGB',
+                     compression_level=compression_level)
+            sti = Image.open(buf)
+            self.assertEqual(list(sti.getdata()), list(img.getdata()))
+            sizes.append(sti.info['header']['size_after_compression'])
+        self.assertGreater(sizes[0], sizes[1])
+
+        with self.assertRaises(AssertionError):
+            img.save(BytesIO(), format=StiImagePlugin.format, flags=['RGB', 'ZLIB'], compression_level=10)
+
+    def test_etrle_frames_zlib(self):
+        images = [Image.new('RGB', (i + 1, 2), (i + 1, 0, 0)) for i in range(3)]
+        aux_object_data = [
+            AuxObjectData(wall_orientation=0, number_of_tiles=0, tile_location_index=0, current_frame=i,
+                          number_of_frames=0, flags=0) for i in range(3)
+        ]
+        buf = BytesIO()
+        images[0].save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE', 'ZLIB', 'AUX_OBJECT_DATA'],
+                       append_images=images[1:], aux_object_data=aux_object_data)
+        sti = Image.open(buf)
+
+        self.assertEqual([x['current_frame'] for x in sti.info['aux_object_data']], [0, 1, 2])
+        for frame in [3, 1, 2]:
+            sti.seek(frame)
+            self.assertEqual(list(sti.convert('RGB').getdata()), list(images[frame - 1].getdata()))
+
+    def test_etrle_small_chunks(self):
+        img = Image.new('P', (300, 200))
+        img.putdata([(i // 7) % 3 * (i % 5) for i in range(300 * 200)])
+        buf = BytesIO()
+        img.save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'])
+        for decodermaxblock in [1, 7, 65536]:
+            sti = Image.open(buf)
+            sti.decodermaxblock = decodermaxblock
+            self.assertEqual(sti.convert('RGB').tobytes(), img.convert('RGB').tobytes())
+
+    def test_etrle_not_enough_data(self):
+        img = Image.new('P', (3, 2), 1)
+        buf = BytesIO()
+        img.save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'])
+        sti = Image.open(buf)
+        sti.tile = [sti.tile[0], sti.tile[1][:3] + (sti.tile[1][3][:2] + (5,),)]
+        with self.assertRaises(ValueError):
+            sti.load()
+
+    def _save_etrle_images(self, sizes):
+        images = [Image.new('RGB', size, (i + 1, 0, 0)) for i, size in enumerate(sizes)]
+        buf = BytesIO()
+        images[0].save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'], append_images=images[1:])
+        return images, buf
+
+    def test_layouts(self):
+        images, buf = self._save_etrle_images([(2, 3), (4, 1), (1, 1), (3, 2)])
+        expected_sizes = {
+            'row': (13, 3),
+            'grid': (9, 6),
+            'shelf': (6, 5),
+        }
+        for layout, expected_size in expected_sizes.items():
+            buf.seek(0)
+            sti = open_sti_image(buf, layout=layout)
+            self.assertEqual(sti.size, expected_size)
+            boxes = sti.info['boxes']
+            for i, box in enumerate(boxes):
+                self.assertEqual((box[2] - box[0], box[3] - box[1]), images[i].size)
+                for other in boxes[i + 1:]:
+                    overlap = min(box[2], other[2]) > max(box[0], other[0]) and min(box[3], other[3]) > max(box[1], other[1])
+                    self.assertFalse(overlap, '{0} {1} {2}'.format(layout, box, other))
+            img = sti.convert('RGB')
+            for box, original in zip(boxes, images):
+                self.assertEqual(list(img.crop(box).getdata()), list(original.getdata()))
+            # the rest is filled with the transparent index
+            self.assertEqual(len([x for x in sti.getdata() if x != 0]), sum(w * h for w, h in (i.size for i in images)))
+
+    def test_default_layout(self):
+        images, buf = self._save_etrle_images([(2, 3), (4, 1)])
+        grid = open_sti_image(buf, layout='grid')
+        buf.seek(0)
+        sti = Image.open(buf)
+
+        self.assertEqual(grid.layout, 'grid')
+        self.assertEqual(sti.layout, 'row')
+        self.assertEqual(sti.size, (7, 3))
+        with self.assertRaises(ValueError):
+            open_sti_image(buf, layout='spiral')
+
+    def test_frames_without_etrle(self):
+        img = Image.new('RGB', (2, 2))
+        buf = BytesIO()
+        img.save(buf, format=StiImagePlugin.format, flags=['RGB'])
+        sti = Image.open(buf)
+
+        self.assertEqual(sti.n_frames, 1)
+        self.assertFalse(sti.is_animated)
+        with self.assertRaises(EOFError):
+            sti.seek(1)
+
+    def test_closes_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            single_path = os.path.join(directory, 'single.sti')
+            Image.new('RGB', (2, 2)).save(single_path, format=StiImagePlugin.format, flags=['RGB'])
+            sti = Image.open(single_path)
+            file = sti.fp
+            sti.load()
+            self.assertTrue(file.closed)
+
+            frames_path = os.path.join(directory, 'frames.sti')
+            Image.new('P', (2, 2), 1).save(frames_path, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'])
+            with Image.open(frames_path) as sti:
+                file = sti.fp
+                sti.load()
+                self.assertFalse(file.closed)
+                sti.seek(1)
+                sti.load()
+            self.assertTrue(file.closed)
+
+    def test_save_etrle_trim(self):
+        img1 = Image.new('RGBA', (6, 5))
+        img1.paste((1, 2, 3, 255), (2, 1, 4, 4))
+        img2 = Image.new('RGBA', (2, 2), (4, 5, 6, 255))
+        buf = BytesIO()
+        img1.save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'], append_images=[img2], trim=True,
+                  offsets=[(0xffff, 3)])
+        sti = Image.open(buf)
+
+        self.assertEqual([(s['offset_x'], s['offset_y']) for s in sti.info['subimage_headers']], [(1, 4), (0, 0)])
+        self.assertEqual([(s['width'], s['height']) for s in sti.info['subimage_headers']], [(2, 3), (2, 2)])
+        sti.seek(1)
+        self.assertEqual(list(sti.convert('RGB').getdata()), 6 * [(1, 2, 3)])
+
+    def test_save_etrle_shared_palette(self):
+        img1 = Image.new('RGBA', (3, 1))
+        img1.putdata([(1, 2, 3, 255), (0, 0, 0, 0), (4, 5, 6, 255)])
+        img2 = Image.new('RGBA', (2, 1))
+        img2.putdata([(7, 8, 9, 255), (1, 2, 3, 255)])
+        buf = BytesIO()
+        img1.save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'], append_images=[img2])
+        sti = Image.open(buf)
+
+        palette_bands = sti.palette.tobytes()
+        self.assertEqual(palette_bands[0:4], b'\x00\x01\x04\x07')
+        self.assertEqual(palette_bands[256:260], b'\x00\x02\x05\x08')
+        self.assertEqual(palette_bands[512:516], b'\x00\x03\x06\x09')
+        self.assertEqual(list(sti.crop(sti.info['boxes'][0]).getdata()), [1, 0, 2])
+        self.assertEqual(list(sti.crop(sti.info['boxes'][1]).getdata()), [3, 1])
+
+    def test_save_etrle_order_of_appearance(self):
+        img = Image.new('RGBA', (5, 1))
+        img.putdata([(9, 9, 9, 0), (5, 5, 6, 255), (5, 5, 5, 255), (9, 9, 9, 0), (5, 5, 6, 255)])
+        buf = BytesIO()
+        img.save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'])
+        sti = Image.open(buf)
+
+        palette_bands = sti.palette.tobytes()
+        self.assertEqual(palette_bands[512:515], b'\x00\x06\x05')
+        self.assertEqual(list(sti.getdata()), [0, 1, 2, 0, 1])
+
+    def test_save_etrle_too_many_colors(self):
+        img = Image.new('RGB', (257, 1))
+        img.putdata([(i % 256, i // 256, 0) for i in range(257)])
+
+        with self.assertRaises(ValueError):
+            img.save(BytesIO(), format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'])
+
+    def test_save_etrle_semi_transparent(self):
+        img = Image.new('RGBA', (2, 1))
+        img.putdata([(1, 2, 3, 255), (4, 5, 6, 128)])
+
+        with self.assertRaises(ValueError):
+            img.save(BytesIO(), format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'])
+        for semi_transparent, expected in [('transparent', [1, 0]), ('opaque', [1, 2])]:
+            buf = BytesIO()
+            img.save(buf, format=StiImagePlugin.format, flags=['INDEXED', 'ETRLE'], semi_transparent=semi_transparent)
+            self.assertEqual(list(Image.open(buf).getdata()), expected)
+
 
 class TestStiImageEncoder(unittest.TestCase):
     def test_colors_official_spec(self):
@@ -3,7 +3,7 @@ import unittest
 from mock import MagicMock as Mock
 from collections import OrderedDict
 
-from ja2py.fileformats import encode_ja2_string, decode_ja2_string, Ja2FileHeader
+from ja2py.fileformats import encode_ja2_string, decode_ja2_string, signed_offset, Ja2FileHeader
 
 class TestJa2StringDecompress(unittest.TestCase):
     def test_encode(self):
@@ -16,6 +16,11 @@ class TestJa2StringDecompress(unittest.TestCase):
         self.assertEqual(decode_ja2_string(b'ham\x00\x00'), 'ham')
         self.assertEqual(decode_ja2_string(b'\x00\x00bar\x00\x00'), 'bar')
 
+    def test_signed_offset(self):
+        self.assertEqual(signed_offset(0x7fff), 0x7fff)
+        self.assertEqual(signed_offset(0x8000), -0x8000)
+        self.assertEqual(signed_offset(0xffff), -1)
+
 
 class TestHeader(Ja2FileHeader):
     fields = [
@@ -95,6 +100,33 @@ class TestJa2FileHeader(unittest.TestCase):
         self.assertEqual(test_header['item3'], 3)
         self.assertEqual(test_header['item4'], 4)
 
+    def test_reading_list_from_bytes(self):
+        test_headers = TestHeader.list_from_bytes(b'\x01\x02\x00\x03\x00\x001234\x00\x00' +
+                                                  b'\x04\x05\x06\x00\x00\x004321\x00\x00')
+
+        self.assertEqual(len(test_headers), 2)
+        self.assertEqual(test_headers[0]['item3'], 768)
+        self.assertEqual(test_headers[0]['item4'], b'1234')
+        self.assertEqual(test_headers[1]['item1'], 4)
+        self.assertEqual(test_headers[1]['item3'], 6)
+        self.assertEqual(test_headers[1]['item4'], b'4321')
+
+    def test_reading_empty_list_from_bytes(self):
+        self.assertEqual(TestHeader.list_from_bytes(b''), [])
+
+    def test_reading_list_from_bytes_with_mapping_function(self):
+        mock = Mock(return_value={'item1': 1, 'item2': 2, 'item3': 3, 'item4': 4})
+
+        class TestHeaderWithMapping(TestHeader):
+            @staticmethod
+            def map_raw_to_attrs(*args, **kwargs):
+                return mock(*args, **kwargs)
+
+        test_headers = TestHeaderWithMapping.list_from_bytes(2 * b'\x01\x02\x00\x03\x00\x001234\x00\x00')
+
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(test_headers[1]['item3'], 3)
+
     def throws_when_converting_to_bytes_with_not_all_fields_set(self):
         test_header = TestHeader(item1=2, item2=3)
         with self.assertRaises(KeyError):